@@ -4,10 +4,11 @@ pragma solidity ^0.8.22;
 // Change these:
 import "@openzeppelin/contracts/token/ERC20/ERC20.sol";
 import "@openzeppelin/contracts/access/AccessControl.sol";
+import "@openzeppelin/contracts/utils/Multicall.sol";
 import "./BridgeToken.sol";
 
 
-contract Destination is AccessControl {
+contract Destination is AccessControl, Multicall {
     bytes32 public constant WARDEN_ROLE = keccak256("BRIDGE_WARDEN_ROLE");
     bytes32 public constant CREATOR_ROLE = keccak256("CREATOR_ROLE");
 	mapping( address => address) public underlying_tokens;
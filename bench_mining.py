@@ -0,0 +1,204 @@
+#!/bin/python
+"""
+    Offline benchmark for findBlockNonce: sweeps the difficulty k and the number of
+    "transactions" per block (sampled from bitcoin_text.txt) and reports
+
+        hash_rate        raw hashes/second of search_nonces for each payload size
+        time_to_solution the distribution of mine_block's time (and hashes) to find a nonce
+        scaling          mine_block_parallel's time to solution per number of processes
+        chain            mine_chain's throughput in blocks/second
+
+    Every result is printed (or written with --output) as one JSON object per line so runs
+    can be compared to catch regressions, e.g.
+
+        python bench_mining.py --difficulty 12 16 --lines 10 100 --trials 20 --output bench.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from findBlockNonce import mine_block, mine_block_parallel, mine_chain, random_transaction_batches
+from findBlockNonce import sample_random_lines, search_nonces
+
+# search_nonces never finds a hash with 257 trailing zero bits, so it hashes the whole range
+NO_SOLUTION_DIFFICULTY = 257
+
+
+def make_block(filename, num_lines, rng):
+    """
+        Returns a random (prev_hash, transactions) pair for one benchmark block
+    """
+    prev_hash = rng.randbytes(32).hex().encode('utf-8')
+    return prev_hash, sample_random_lines(filename, num_lines)
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'median': statistics.median(values),
+        'mean': statistics.fmean(values),
+        'p90': values[min(len(values) - 1, int(0.9 * len(values)))],
+        'max': values[-1],
+    }
+
+
+def measure_hash_rate(filename, num_lines, num_hashes, rng):
+    """
+        Hashes/second of search_nonces over exactly num_hashes nonces
+    """
+    prev_hash, transactions = make_block(filename, num_lines, rng)
+    prefix = prev_hash + b''.join(t.encode('utf-8') for t in transactions)
+
+    start = time.perf_counter()
+    search_nonces(NO_SOLUTION_DIFFICULTY, prefix, 0, num_hashes)
+    elapsed = time.perf_counter() - start
+    return {
+        'benchmark': 'hash_rate',
+        'lines': num_lines,
+        'payload_bytes': len(prefix),
+        'hashes': num_hashes,
+        'seconds': elapsed,
+        'hashes_per_second': num_hashes / elapsed,
+    }
+
+
+def measure_time_to_solution(filename, k, num_lines, trials, rng):
+    """
+        Distribution of mine_block's time to solution; mine_block returns the smallest valid
+        nonce so the number of hashes of a trial is that nonce + 1
+    """
+    times = []
+    hashes = []
+    for _ in range(trials):
+        prev_hash, transactions = make_block(filename, num_lines, rng)
+        start = time.perf_counter()
+        nonce = mine_block(k, prev_hash, transactions)
+        times.append(time.perf_counter() - start)
+        hashes.append(int(nonce) + 1)
+    return {
+        'benchmark': 'time_to_solution',
+        'difficulty': k,
+        'lines': num_lines,
+        'trials': trials,
+        'seconds': summarize(times),
+        'hashes': summarize(hashes),
+        'hashes_per_second': sum(hashes) / sum(times),
+    }
+
+
+def measure_scaling(filename, k, num_lines, trials, process_counts, rng):
+    """
+        mine_block_parallel's median time to solution for every number of processes, on the
+        same blocks, with the speedup relative to the first count
+    """
+    blocks = [make_block(filename, num_lines, rng) for _ in range(trials)]
+    results = []
+    for processes in process_counts:
+        times = []
+        for prev_hash, transactions in blocks:
+            start = time.perf_counter()
+            mine_block_parallel(k, prev_hash, transactions, processes=processes)
+            times.append(time.perf_counter() - start)
+        results.append({
+            'benchmark': 'scaling',
+            'difficulty': k,
+            'lines': num_lines,
+            'trials': trials,
+            'processes': processes,
+            'seconds': summarize(times),
+        })
+
+    base_median = results[0]['seconds']['median']
+    for result in results:
+        result['speedup'] = base_median / result['seconds']['median']
+    return results
+
+
+def measure_chain_throughput(filename, k, num_lines, num_blocks, processes):
+    """
+        Blocks/second of mine_chain over num_blocks blocks of num_lines random lines
+    """
+    start = time.perf_counter()
+    mined = sum(1 for _ in mine_chain(k, random_transaction_batches(filename, num_lines, num_blocks),
+                                      processes=processes))
+    elapsed = time.perf_counter() - start
+    return {
+        'benchmark': 'chain',
+        'difficulty': k,
+        'lines': num_lines,
+        'blocks': mined,
+        'processes': processes,
+        'seconds': elapsed,
+        'blocks_per_second': mined / elapsed,
+    }
+
+
+def run_benchmarks(filename, difficulties, line_counts, trials, process_counts, num_hashes, seed, chain_blocks=0):
+    """
+        Runs the whole sweep and yields one result dictionary at a time
+    """
+    rng = random.Random(seed)
+    random.seed(seed)  # sample_random_lines uses the module level generator
+
+    for num_lines in line_counts:
+        yield measure_hash_rate(filename, num_lines, num_hashes, rng)
+
+    for k in difficulties:
+        for num_lines in line_counts:
+            yield measure_time_to_solution(filename, k, num_lines, trials, rng)
+
+    if process_counts:
+        yield from measure_scaling(filename, max(difficulties), line_counts[0], trials, process_counts, rng)
+
+    if chain_blocks:
+        for k in difficulties:
+            for processes in process_counts or [1]:
+                yield measure_chain_throughput(filename, k, line_counts[0], chain_blocks, processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark findBlockNonce.mine_block")
+    parser.add_argument('--file', default="bitcoin_text.txt", help="transactions corpus")
+    parser.add_argument('--difficulty', type=int, nargs='+', default=[8, 12, 16], help="values of k to sweep")
+    parser.add_argument('--lines', type=int, nargs='+', default=[10, 100, 1000], help="transactions per block")
+    parser.add_argument('--trials', type=int, default=10, help="blocks mined per configuration")
+    parser.add_argument('--processes', type=int, nargs='*', default=None,
+                        help="process counts for the scaling run (default 1, 2, 4, ... up to the core count)")
+    parser.add_argument('--hashes', type=int, default=200000, help="hashes per hash rate measurement")
+    parser.add_argument('--chain-blocks', type=int, default=20, help="blocks per mine_chain run (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON lines to this file instead of stdout")
+    args = parser.parse_args()
+
+    process_counts = args.processes
+    if process_counts is None:
+        cores = os.cpu_count() or 1
+        process_counts = sorted({min(1 << i, cores) for i in range(cores.bit_length() + 1)})
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        header = {
+            'benchmark': 'environment',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+        }
+        out.write(json.dumps(header) + "\n")
+        for result in run_benchmarks(args.file, args.difficulty, args.lines, args.trials, process_counts,
+                                     args.hashes, args.seed, args.chain_blocks):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,24 @@
 import csv
+import functools
 import json
 import os
+import sys
+import threading
 import time
 
 from eth_account import Account
+from hexbytes import HexBytes
 from web3 import Web3
+from web3.exceptions import TransactionNotFound
+from web3.logs import DISCARD
 from web3.middleware import ExtraDataToPOAMiddleware  # Necessary for POA chains
 
+from tx_manager import get_nonce_manager, ReceiptTracker, get_chain_context
+from bridge_state import BRIDGE_STATE_DB, open_state_db, load_cursor, save_cursor, cursor_start_block, is_processed
+from bridge_state import SEEN, SUBMITTED, CONFIRMED, FAILED, event_keys, is_handled, ledger_state, record_events
+from bridge_state import failed_events, stale_events, abandon_failed_events, MAX_RELAY_ATTEMPTS
+from bridge_state import save_block_hash, recent_block_hashes, rewind
+
 # If the file is empty, it will raise an exception
 with open("secret_key.txt", "r") as f:
     # Read all lines, then take the first element (the first line) and strip it
@@ -45,12 +57,16 @@ def get_contract_info(chain, contract_info):
 
 
 # Helper function to build, sign, and send a transaction to a contract function
-def send_transaction(w3, account, private_key, contract, function_name, *args, nonce=None):
+# Pass wait_for_receipt=False to broadcast and return the tx hash right away (see tx_manager.ReceiptTracker)
+# before_broadcast(tx_hash) is called with the hash of the signed transaction before it is broadcast
+def send_transaction(w3, account, private_key, contract, function_name, *args, nonce=None, wait_for_receipt=True,
+                     before_broadcast=None):
 
+    chain_context = get_chain_context(w3)
     tx_params = {
-        'chainId': w3.eth.chain_id,
+        'chainId': chain_context.chain_id,
         'from': account.address,
-        'gasPrice': w3.eth.gas_price
+        'gasPrice': chain_context.gas_price()
     }
 
     if nonce is not None:
@@ -58,14 +74,19 @@ def send_transaction(w3, account, private_key, contract, function_name, *args, n
     else:
         tx_params['nonce'] = w3.eth.get_transaction_count(account.address)
 
+    # No 'gas' key: build_transaction always runs estimate_gas, which raises (before anything is
+    # broadcast) if the call would revert
     transaction = contract.functions[function_name](*args).build_transaction(tx_params)
-    gas_limit = w3.eth.estimate_gas(transaction)
-    transaction['gas'] = gas_limit
 
     signed_txn = w3.eth.account.sign_transaction(transaction, private_key=private_key)
+    if before_broadcast is not None:
+        before_broadcast(signed_txn.hash)
     tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
     #print(f"Transaction sent! Hash: {tx_hash.hex()}")
 
+    if not wait_for_receipt:
+        return tx_hash
+
     tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
     #print(f"Transaction confirmed in block: {tx_receipt.blockNumber}")
     if tx_receipt.status == 1:
@@ -74,9 +95,19 @@ def send_transaction(w3, account, private_key, contract, function_name, *args, n
         print(f"Transaction failed!")
     return tx_receipt
 
-last_scanned_block = {'source': None, 'destination': None}
 ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
 
+# Seconds between scans in daemon mode, roughly one block time per chain
+POLL_INTERVAL = {'source': 2, 'destination': 3}
+
+# Blocks an event must be buried under before it is relayed, reorgs within this depth are
+# detected and rolled back by check_reorg
+CONFIRMATIONS = {'source': 1, 'destination': 3}
+
+# Batch relay mode: at most RELAY_BATCH_SIZE events per multicall, events are collected for RELAY_FLUSH_INTERVAL seconds
+RELAY_BATCH_SIZE = 25
+RELAY_FLUSH_INTERVAL = 15
+
 w3_destination = connect_to('destination')
 if not w3_destination.is_connected():
     print("Failed to connect to destination chain for setup.")
@@ -118,8 +149,36 @@ if not is_warden:
 else:
     print(f"Autograder sender {autograder_sender_address} already has WARDEN_ROLE.")
 
+class WrappedTokenCache:
+    """
+        In-process copy of the Destination contract's wrapped_tokens mapping (underlying -> wrapped)
+        A token is read from the contract (one eth_call) the first time it is looked up, and kept once
+        it has a wrapped token: entries never go stale since createToken refuses to replace an existing
+        mapping. Tokens without a wrapped token are read again on every lookup, they may be created later.
+    """
+
+    def __init__(self, w3_destination, destination_contract):
+        self.w3 = w3_destination
+        self.contract = destination_contract
+        self.wrapped_tokens = {}
+
+    def lookup(self, underlying_token):
+        """
+            Returns the wrapped token for underlying_token, or ZERO_ADDRESS if it has not been created
+        """
+        wrapped_token = self.wrapped_tokens.get(underlying_token)
+        if wrapped_token is None:
+            wrapped_token = self.contract.functions.wrapped_tokens(underlying_token).call()
+            if wrapped_token != ZERO_ADDRESS:
+                self.wrapped_tokens[underlying_token] = wrapped_token
+        return wrapped_token
+
+
 # Helper function to handle Deposit events
-def handle_deposit_event(event, w3_destination, destination_contract, warden_account_destination, private_key, current_nonce_destination):
+# The wrap transaction is only broadcast here, its receipt is collected by receipt_tracker
+# Returns the hash of the wrap transaction, or None if it could not be sent
+def handle_deposit_event(event, w3_destination, destination_contract, warden_account_destination, private_key,
+                         nonce_manager, receipt_tracker, wrapped_tokens=None, before_broadcast=None):
 
     _token = event['args']['token']
     _recipient = event['args']['recipient']
@@ -127,23 +186,40 @@ def handle_deposit_event(event, w3_destination, destination_contract, warden_acc
     #print(f"  Token: {_token}, Recipient: {_recipient}, Amount: {_amount}")
 
     try:
-        wrapped_token_address = destination_contract.functions.wrapped_tokens(_token).call()
+        if wrapped_tokens is not None:
+            wrapped_token_address = wrapped_tokens.lookup(_token)
+        else:
+            wrapped_token_address = destination_contract.functions.wrapped_tokens(_token).call()
         #print(f"DEBUG: Checked wrapped_tokens mapping for {_token}, found: {wrapped_token_address}")
-        if wrapped_token_address == Web3.to_checksum_address('0x0000000000000000000000000000000000000000'):
-            print(f"DEBUG: WARNING - No wrapped token found for {_token}")
+    except Exception as e:
+        print(f"  Error reading wrapped_tokens on Destination: {e}")
+        return None
+
+    if wrapped_token_address is None or wrapped_token_address == ZERO_ADDRESS:
+        # wrap() would revert, don't spend an estimate_gas (or gas) on it
+        print(f"  No wrapped token found for {_token}, skipping Deposit")
+        return None
 
+    try:
         #print(f"Calling wrap with arguments: token={_token}, recipient={_recipient}, amount={_amount}")
-        send_transaction(w3_destination, warden_account_destination, private_key,
-                         destination_contract, "wrap", _token, _recipient, _amount, nonce=current_nonce_destination)
-        #print("  Successfully called wrap() on Destination contract.")
-        return True, current_nonce_destination + 1
+        tx_hash = send_transaction(w3_destination, warden_account_destination, private_key,
+                                   destination_contract, "wrap", _token, _recipient, _amount,
+                                   nonce=nonce_manager.next_nonce(), wait_for_receipt=False,
+                                   before_broadcast=before_broadcast)
+        receipt_tracker.track(tx_hash)
+        return tx_hash
     except Exception as e:
+        # The nonce handed out for this transaction was not used
+        nonce_manager.resync()
         print(f"  Error calling wrap() on Destination: {e}")
-        return False, current_nonce_destination
+        return None
 
 
 # Helper function to handle Unwrap events
-def handle_unwrap_event(event, w3_source, source_contract, warden_account_source, private_key, current_nonce_source):
+# The withdraw transaction is only broadcast here, its receipt is collected by receipt_tracker
+# Returns the hash of the withdraw transaction, or None if it could not be sent
+def handle_unwrap_event(event, w3_source, source_contract, warden_account_source, private_key,
+                        nonce_manager, receipt_tracker, before_broadcast=None):
 
     _underlying_token = event['args']['underlying_token']
     _recipient = event['args']['to']
@@ -153,85 +229,406 @@ def handle_unwrap_event(event, w3_source, source_contract, warden_account_source
 
     try:
         #print(f"Calling withdraw with arguments: token={_underlying_token}, recipient={_recipient}, amount={_amount}")
-        tx_hash_withdraw = send_transaction(w3_source, warden_account_source, private_key,
-                                            source_contract, "withdraw", _underlying_token, _recipient, _amount,
-                                            nonce=current_nonce_source)
-        #print(f"  Withdraw transaction Hash (Source Chain): {tx_hash_withdraw.transactionHash.hex()}")  # Print the hash
-        #print("  Successfully called withdraw() on Source contract.")
-        return True, current_nonce_source + 1
+        tx_hash = send_transaction(w3_source, warden_account_source, private_key,
+                                   source_contract, "withdraw", _underlying_token, _recipient, _amount,
+                                   nonce=nonce_manager.next_nonce(), wait_for_receipt=False,
+                                   before_broadcast=before_broadcast)
+        receipt_tracker.track(tx_hash)
+        return tx_hash
     except Exception as e:
+        # The nonce handed out for this transaction was not used
+        nonce_manager.resync()
         print(f"  Error calling withdraw() on Source: {e}")
-        return False, current_nonce_source
+        return None
 
-def scan_blocks(chain, contract_info="contract_info.json"):
 
-    w3_source = connect_to('source')
-    w3_destination = connect_to('destination')
+def relay_call(chain, event, bridge):
+    """
+        Returns the (function_name, args) that relays event (scanned on chain) on the other chain,
+        or None if the event cannot be relayed
+    """
+    if chain == 'source':
+        _token = event['args']['token']
+        try:
+            wrapped_token_address = bridge['wrapped_tokens'].lookup(_token)
+        except Exception as e:
+            print(f"  Error reading wrapped_tokens on Destination: {e}")
+            return None
+        if wrapped_token_address in [None, ZERO_ADDRESS]:
+            print(f"  No wrapped token found for {_token}, skipping Deposit")
+            return None
+        return "wrap", [_token, event['args']['recipient'], event['args']['amount']]
+    return "withdraw", [event['args']['underlying_token'], event['args']['to'], event['args']['amount']]
+
+
+def supports_multicall(contract):
+    return any(item.get('type') == 'function' and item.get('name') == 'multicall' for item in contract.abi)
+
+
+# Helper function to relay several events with a single multicall transaction
+# Returns the hash of the multicall transaction, or None (without using a nonce) if the batch
+# could not be sent. send_transaction estimates the gas of every batch afresh, so a batch with one
+# call that would revert (or that costs more than an earlier batch) fails here and not on-chain
+def relay_batch(calls, w3, contract, warden_account, private_key, nonce_manager, receipt_tracker,
+                before_broadcast=None):
+
+    data = [contract.encode_abi(function_name, args=args) for function_name, args in calls]
+    try:
+        tx_hash = send_transaction(w3, warden_account, private_key, contract, "multicall", data,
+                                   nonce=nonce_manager.next_nonce(), wait_for_receipt=False,
+                                   before_broadcast=before_broadcast)
+        receipt_tracker.track(tx_hash)
+        return tx_hash
+    except Exception as e:
+        nonce_manager.resync()
+        print(f"  Error calling multicall() with {len(calls)} calls: {e}")
+        return None
 
-    source_details = get_contract_info('source', contract_info)
-    destination_details = get_contract_info('destination', contract_info)
 
-    source_contract_address = Web3.to_checksum_address(source_details["address"])
-    source_contract = w3_source.eth.contract(address=source_contract_address, abi=source_details["abi"])
+def setup_bridge(contract_info="contract_info.json", warden_private_key=None):
+    """
+        Connects to both chains and builds the contract objects and warden accounts once,
+        so they can be shared by every scan (and by both daemon threads)
+        Returns a dictionary keyed by 'source' and 'destination'
+    """
+    if warden_private_key is None:
+        warden_private_key = private_key
+
+    bridge = {}
+    for chain in ['source', 'destination']:
+        w3 = connect_to(chain)
+        details = get_contract_info(chain, contract_info)
+        contract_address = Web3.to_checksum_address(details["address"])
+        bridge[chain] = {
+            'w3': w3,
+            'contract_address': contract_address,
+            'contract': w3.eth.contract(address=contract_address, abi=details["abi"]),
+            'warden_account': w3.eth.account.from_key(warden_private_key),
+        }
+    bridge['private_key'] = warden_private_key
+
+    bridge['wrapped_tokens'] = WrappedTokenCache(bridge['destination']['w3'], bridge['destination']['contract'])
+    return bridge
+
+
+def check_reorg(w3, state_db, chain):
+    """
+        Compares the buffered hashes of recently scanned blocks with the chain. If the newest one
+        no longer matches, the cursor is rewound to the newest block that still matches (the fork point)
+        so the blocks after it are scanned again; the relay ledger keys events by transaction hash
+        and position in the transaction (see bridge_state.event_keys), so events of transactions
+        re-mined in another block are recognized and not relayed twice.
+    """
+    buffered = recent_block_hashes(state_db, chain)
+    for i, (block_number, block_hash) in enumerate(buffered):
+        if w3.eth.get_block(block_number)['hash'].hex() == block_hash:
+            if i > 0:
+                print(f"Reorg detected on {chain}, rewinding to block {block_number}")
+                rewind(state_db, chain, block_number)
+            return
+    if buffered:
+        # The fork is older than the buffer, rescan from just before the oldest buffered block
+        oldest_block = buffered[-1][0]
+        print(f"Reorg deeper than the buffered blocks on {chain}, rewinding to block {oldest_block - 1}")
+        rewind(state_db, chain, oldest_block - 1)
+
+
+def relay_status(w3, relay_tx_hash):
+    """
+        Returns CONFIRMED or FAILED if the relay transaction was mined (and succeeded or reverted),
+        SUBMITTED if it is still pending, or None if the node does not know it (it was never broadcast or was dropped)
+    """
+    try:
+        receipt = w3.eth.get_transaction_receipt(HexBytes(relay_tx_hash))
+        return CONFIRMED if receipt.status == 1 else FAILED
+    except TransactionNotFound:
+        pass
+    try:
+        w3.eth.get_transaction(HexBytes(relay_tx_hash))
+        return SUBMITTED
+    except TransactionNotFound:
+        return None
 
-    destination_contract_address = Web3.to_checksum_address(destination_details["address"])
-    destination_contract = w3_destination.eth.contract(address=destination_contract_address, abi=destination_details["abi"])
 
-    warden_account_source = w3_source.eth.account.from_key(private_key)
-    warden_account_destination = w3_destination.eth.account.from_key(private_key)
+def reconcile_stale_events(chain, relay_side, state_db):
+    """
+        Settles the events of chain left SEEN or SUBMITTED for longer than RELAY_STALE_TIMEOUT, e.g. after a crash
+        between recording and broadcasting, a dropped or underpriced relay transaction, or a receipt timeout.
+        An event whose relay transaction landed is marked CONFIRMED, one whose relay transaction is still
+        pending stays SUBMITTED, any other is marked FAILED so failed_relays retries it.
+    """
+    for key, state, relay_tx_hash in stale_events(state_db, chain):
+        try:
+            status = None if relay_tx_hash is None else relay_status(relay_side['w3'], relay_tx_hash)
+            if status == CONFIRMED:
+                record_events(state_db, chain, [key], CONFIRMED)
+            elif status == SUBMITTED:
+                # Still in the mempool, checked again after another RELAY_STALE_TIMEOUT
+                record_events(state_db, chain, [key], SUBMITTED)
+            else:
+                print(f"  Relay of event {key} on {chain} is stuck {state}, retrying it")
+                record_events(state_db, chain, [key], FAILED)
+        except Exception as e:
+            print(f"  Could not check the relay of event {key} on {chain}: {e}")
+
+
+def failed_relays(chain, event_type, scan_side, relay_side, state_db):
+    """
+        Returns the (event, key) pairs of the events of chain whose relay FAILED (fewer than MAX_RELAY_ATTEMPTS
+        times) and whose retry backoff has elapsed, so that they are relayed again, read back from the receipts
+        of the transactions that emitted them.
+        An event whose last relay transaction was mined after all is marked CONFIRMED instead,
+        and one whose relay transaction is still pending is left for a later scan.
+    """
+    for key in abandon_failed_events(state_db, chain):
+        print(f"Giving up on relaying event {key} on {chain} after {MAX_RELAY_ATTEMPTS} failed attempts")
+
+    retries = []
+    for key, relay_tx_hash in failed_events(state_db, chain):
+        try:
+            status = None if relay_tx_hash is None else relay_status(relay_side['w3'], relay_tx_hash)
+            if status == CONFIRMED:
+                record_events(state_db, chain, [key], CONFIRMED)
+                continue
+            if status == SUBMITTED:
+                continue
 
-    SCAN_WINDOW_SIZE = 20
+            receipt = scan_side['w3'].eth.get_transaction_receipt(HexBytes(key[0]))
+            events = [event for event in event_type().process_receipt(receipt, errors=DISCARD)
+                      if event['address'] == scan_side['contract_address']]
+            matches = [(event, event_key) for event, event_key in zip(events, event_keys(events))
+                       if event_key == key]
+            if not matches:
+                # Counts as one more failure so the row is eventually given up on
+                print(f"  Failed event {key} is no longer in its transaction on {chain}")
+                record_events(state_db, chain, [key], FAILED)
+            retries += matches
+        except Exception as e:
+            print(f"  Could not read back failed event {key} on {chain}: {e}")
+    return retries
+
+
+def scan_blocks(chain, contract_info="contract_info.json", state_file=BRIDGE_STATE_DB, bridge=None, state_db=None,
+                batch_size=1):
+    """
+        Relays the new Deposit events (chain='source') or Unwrap events (chain='destination')
+        since the last run. bridge and state_db may be passed in to reuse the connections,
+        contract objects and state file across calls (see run_daemon)
+        With batch_size > 1, up to batch_size events are relayed per multicall transaction
+        (when the contract on the other chain has multicall)
+    """
+    SCAN_WINDOW_SIZE = 20  # Look-back used the first time a chain is scanned
+    MAX_BLOCKS_PER_SCAN = 2000  # Upper bound on the range fetched in one call when catching up
 
-    latest_block_source = w3_source.eth.block_number
-    start_block_source = max(0, latest_block_source - SCAN_WINDOW_SIZE)
+    if chain not in ['source', 'destination']:
+        print(f"Invalid chain argument '{chain}'. Should be 'source' or 'destination'.")
+        return
 
-    latest_block_destination = w3_destination.eth.block_number
-    start_block_destination = max(0, latest_block_destination - SCAN_WINDOW_SIZE)
+    if bridge is None:
+        bridge = setup_bridge(contract_info)
 
-    current_nonce_source_run = w3_source.eth.get_transaction_count(warden_account_source.address)
-    current_nonce_destination_run = w3_destination.eth.get_transaction_count(warden_account_destination.address)
+    close_state_db = state_db is None
+    if close_state_db:
+        state_db = open_state_db(state_file)
 
-    if chain == 'source':
-        #print(f"Scanning source chain from block {start_block_source} to {latest_block_source} (last 5 blocks)...")
-        deposit_filter = source_contract.events.Deposit.create_filter(
-            from_block=start_block_source,
-            to_block=latest_block_source,
-            address=source_contract_address
-        )
-        deposit_events = deposit_filter.get_all_entries()
-        #print(f"Created filter for Deposit events on source chain from block {start_block_source} to {latest_block_source}.")
-        #print(f"Found {len(deposit_events)} Deposit events.")
-
-        for event in deposit_events:
-            #print(f"Raw Deposit event: {event}")
-            #print(f"Detected Deposit event on Source Chain:\n  Token: {event['args']['token']}\n  Recipient (Destination): {event['args']['recipient']}\n  Amount: {event['args']['amount']}")
-
-            updated_nonce = current_nonce_destination_run
-            tx_successful, updated_nonce = handle_deposit_event(event, w3_destination, destination_contract, warden_account_destination, private_key, updated_nonce)
-            if tx_successful:
-                current_nonce_destination_run = updated_nonce
-
-    elif chain == 'destination':
-        #print(f"Scanning destination chain from block {start_block_destination} to {latest_block_destination} (last 5 blocks)...")
-        unwrap_filter = destination_contract.events.Unwrap.create_filter(
-            from_block=start_block_destination,
-            to_block=latest_block_destination,
-            address=destination_contract_address
-        )
-        unwrap_events = unwrap_filter.get_all_entries()
-        #print(f"Created filter for Unwrap events on destination chain from block {start_block_destination} to {latest_block_destination}.")
-        #print(f"Found {len(unwrap_events)} Unwrap events.")
-
-        for event in unwrap_events:
-            #print(f"Raw Unwrap event: {event}")
-            #print(f"Detected Unwrap event on Destination Chain:\n  Underlying Token: {event['args']['underlying_token']}\n  Recipient (Source): {event['args']['to']}\n  Amount: {event['args']['amount']}")
-
-            updated_nonce = current_nonce_source_run
-            tx_successful, updated_nonce = handle_unwrap_event(event, w3_source, source_contract, warden_account_source, private_key, updated_nonce)
-            if tx_successful:
-                current_nonce_source_run = updated_nonce
-    else:
-        print(f"Invalid chain argument '{chain}'. Should be 'source' or 'destination'.")
+    try:
+        other_chain = 'destination' if chain == 'source' else 'source'
+        scan_side = bridge[chain]
+        relay_side = bridge[other_chain]
+
+        # Only blocks with enough confirmations are scanned
+        latest_block = scan_side['w3'].eth.block_number - CONFIRMATIONS[chain]
+
+        check_reorg(scan_side['w3'], state_db, chain)
+        cursor = load_cursor(state_db, chain)
+        if cursor is None:
+            start_block = max(0, latest_block - SCAN_WINDOW_SIZE)
+        else:
+            start_block = cursor_start_block(cursor)
+        end_block = min(latest_block, start_block + MAX_BLOCKS_PER_SCAN - 1)
+
+        if end_block < start_block:
+            # Nothing new since the last run
+            return
+
+        # Read before the logs, so a reorg of end_block during the scan is caught by the next check_reorg
+        end_block_hash = scan_side['w3'].eth.get_block(end_block)['hash'].hex()
+
+        if chain == 'source':
+            #print(f"Scanning source chain from block {start_block} to {end_block}...")
+            event_filter = scan_side['contract'].events.Deposit.create_filter(
+                from_block=start_block,
+                to_block=end_block,
+                address=scan_side['contract_address']
+            )
+            event_type = scan_side['contract'].events.Deposit
+            handle_event = functools.partial(handle_deposit_event, wrapped_tokens=bridge['wrapped_tokens'])
+        else:
+            #print(f"Scanning destination chain from block {start_block} to {end_block}...")
+            event_filter = scan_side['contract'].events.Unwrap.create_filter(
+                from_block=start_block,
+                to_block=end_block,
+                address=scan_side['contract_address']
+            )
+            event_type = scan_side['contract'].events.Unwrap
+            handle_event = handle_unwrap_event
+
+        # Events whose relay failed in an earlier run are retried first (they are behind the cursor)
+        reconcile_stale_events(chain, relay_side, state_db)
+        pending = failed_relays(chain, event_type, scan_side, relay_side, state_db)
+        retried_keys = {key for _, key in pending}
+        num_retried = len(pending)
+
+        # Events already submitted or confirmed in an earlier run are never relayed twice. The ledger key
+        # does not depend on the block, so this also holds for transactions re-mined in another block after
+        # a reorg (check_reorg rewinds the cursor and the fork is scanned again)
+        scanned = event_filter.get_all_entries()
+        pending += [(event, key) for event, key in zip(scanned, event_keys(scanned))
+                    if not is_processed(cursor, event['blockNumber'], event['logIndex'])
+                    and not is_handled(state_db, chain, key)
+                    and key not in retried_keys]
+        events = [event for event, _ in pending]
+        keys = [key for _, key in pending]
+        #print(f"Found {len(events)} new events on {chain}.")
+
+        if events:
+            # The relay transactions are sent on the other chain, back to back with locally allocated nonces
+            relay_account = relay_side['warden_account']
+            nonce_manager = get_nonce_manager(other_chain, relay_side['w3'], relay_account.address)
+            receipt_tracker = ReceiptTracker(relay_side['w3'], nonce_manager)
+            relayed = {}  # relay tx hash -> ledger keys of the events it relays
+
+            if batch_size <= 1 or not supports_multicall(relay_side['contract']):
+                batch_size = 1
+
+            def mark_submitted(submitted_keys):
+                # The events are SUBMITTED (with the signed hash) before the broadcast, a crash right
+                # after it can then never lead to relaying them a second time
+                return lambda tx_hash: record_events(state_db, chain, submitted_keys, SUBMITTED, tx_hash.hex())
+
+            # Retried events are relayed one at a time, a batch that reverted on-chain is not sent again as a whole
+            spans = [(i, i + 1) for i in range(num_retried)]
+            spans += [(i, min(i + batch_size, len(events))) for i in range(num_retried, len(events), batch_size)]
+
+            for start, stop in spans:
+                batch = events[start:stop]
+                batch_keys = keys[start:stop]
+                if len(batch_keys) != len(batch):
+                    # Never move the cursor past events that have no ledger key
+                    raise RuntimeError(f"Batch of {len(batch)} events on {chain} has {len(batch_keys)} ledger keys")
+                record_events(state_db, chain, batch_keys, SEEN)
+
+                calls = []
+                call_keys = []
+                if len(batch) > 1:
+                    for event, key in zip(batch, batch_keys):
+                        call = relay_call(chain, event, bridge)
+                        if call is not None:
+                            calls.append(call)
+                            call_keys.append(key)
+
+                relay_tx_hash = None
+                if len(calls) > 1:
+                    relay_tx_hash = relay_batch(calls, relay_side['w3'], relay_side['contract'], relay_account,
+                                                bridge['private_key'], nonce_manager, receipt_tracker,
+                                                before_broadcast=mark_submitted(call_keys))
+
+                if relay_tx_hash is not None:
+                    sent = [(relay_tx_hash, call_keys)]
+                    skipped_keys = [key for key in batch_keys if key not in call_keys]
+                    if skipped_keys:
+                        record_events(state_db, chain, skipped_keys, FAILED)
+                else:
+                    # Nothing worth batching, or the batch would fail as a whole: relay one event at a time
+                    sent = [(handle_event(event, relay_side['w3'], relay_side['contract'], relay_account,
+                                          bridge['private_key'], nonce_manager, receipt_tracker,
+                                          before_broadcast=mark_submitted([key])), [key])
+                            for event, key in zip(batch, batch_keys)]
+
+                for relay_tx_hash, sent_keys in sent:
+                    if relay_tx_hash is None:
+                        record_events(state_db, chain, sent_keys, FAILED)
+                    else:
+                        record_events(state_db, chain, sent_keys, SUBMITTED, relay_tx_hash.hex())
+                        relayed[relay_tx_hash] = sent_keys
+
+                # Every event of the batch must have left SEEN before the cursor moves past it,
+                # anything that slipped through is recorded FAILED so it is retried
+                unrecorded = [key for key in batch_keys if ledger_state(state_db, chain, key) in [None, SEEN]]
+                if unrecorded:
+                    print(f"  {len(unrecorded)} events were neither relayed nor failed, marking them FAILED")
+                    record_events(state_db, chain, unrecorded, FAILED)
+
+                # Batches made only of retried events are behind the cursor, which must not move back
+                if not is_processed(cursor, batch[-1]['blockNumber'], batch[-1]['logIndex']):
+                    save_cursor(state_db, chain, batch[-1]['blockNumber'], batch[-1]['logIndex'])
+
+            for tx_hash, tx_receipt in receipt_tracker.wait():
+                if tx_receipt is not None and tx_receipt.status == 1:
+                    print(f"Transaction successful!")
+                    record_events(state_db, chain, relayed[tx_hash], CONFIRMED)
+                elif tx_receipt is not None:
+                    print(f"Transaction failed! Hash: {tx_hash.hex()}")
+                    record_events(state_db, chain, relayed[tx_hash], FAILED)
+                else:
+                    # Still unknown, the events stay SUBMITTED so they are not relayed a second time
+                    print(f"No receipt yet for transaction {tx_hash.hex()}")
+
+        # The whole range has been handled, the next run starts after end_block
+        save_cursor(state_db, chain, end_block)
+        save_block_hash(state_db, chain, end_block, end_block_hash)
+    finally:
+        if close_state_db:
+            state_db.close()
+
+
+def watch_chain(chain, bridge, state_file, poll_interval, stop_event, batch_size=1):
+    """
+        Daemon worker: keeps scanning one chain until stop_event is set
+    """
+    state_db = open_state_db(state_file)
+    try:
+        while not stop_event.is_set():
+            try:
+                scan_blocks(chain, bridge=bridge, state_db=state_db, batch_size=batch_size)
+            except Exception as e:
+                print(f"Error scanning {chain}: {e}")
+            stop_event.wait(poll_interval[chain])
+    finally:
+        state_db.close()
+
+
+def run_daemon(contract_info="contract_info.json", state_file=BRIDGE_STATE_DB, poll_interval=None, batch_size=1):
+    """
+        Long-running mode: watches the source Deposit stream and the destination Unwrap stream
+        concurrently (one thread per chain), sharing connections and contract objects
+        across iterations. Stops on Ctrl-C
+        In batch mode (batch_size > 1) each chain is scanned every RELAY_FLUSH_INTERVAL seconds
+        so that the events of that interval are relayed together
+    """
+    if poll_interval is None:
+        if batch_size > 1:
+            poll_interval = {chain: RELAY_FLUSH_INTERVAL for chain in ['source', 'destination']}
+        else:
+            poll_interval = POLL_INTERVAL
+
+    bridge = setup_bridge(contract_info)
+    stop_event = threading.Event()
+    workers = [threading.Thread(target=watch_chain, args=(chain, bridge, state_file, poll_interval, stop_event, batch_size),
+                                name=f"bridge-{chain}", daemon=True)
+               for chain in ['source', 'destination']]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=1)
+    except KeyboardInterrupt:
+        print("Stopping bridge daemon...")
+        stop_event.set()
+        for worker in workers:
+            worker.join()
 
 
 # Only called once to register by main and then commented out to avoid repeated function calls by autograder
@@ -316,5 +713,8 @@ if __name__ == "__main__":
 
     # register_and_create_tokens(private_key)
 
+    if "--daemon" in sys.argv:
+        run_daemon(batch_size=RELAY_BATCH_SIZE if "--batch" in sys.argv else 1)
+
 
 
@@ -0,0 +1,245 @@
+import sqlite3
+import threading
+import time
+
+# Default location of the bridge's local state (scan cursors, relay ledger)
+BRIDGE_STATE_DB = "bridge_state.db"
+
+# Relay ledger states, an event is never relayed again once it is SUBMITTED or CONFIRMED
+SEEN = 'seen'
+SUBMITTED = 'submitted'
+CONFIRMED = 'confirmed'
+FAILED = 'failed'
+ABANDONED = 'abandoned'  # FAILED MAX_RELAY_ATTEMPTS times, no longer retried
+HANDLED_STATES = (SUBMITTED, CONFIRMED)
+
+# A FAILED event is retried by later scans until it has failed this many times, waiting
+# RELAY_RETRY_BACKOFF seconds before the first retry and twice as long after every further failure
+MAX_RELAY_ATTEMPTS = 8
+RELAY_RETRY_BACKOFF = 30
+# Seconds after which an event still SEEN or SUBMITTED is checked again (longer than a receipt wait)
+RELAY_STALE_TIMEOUT = 600
+
+# Number of recent scan end blocks whose hashes are kept per chain to detect reorgs
+REORG_BUFFER_SIZE = 64
+
+_db_lock = threading.Lock()
+
+
+def open_state_db(path=BRIDGE_STATE_DB):
+    """
+        Opens (and creates if needed) the SQLite file that holds the bridge's
+        durable state and returns the connection
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    with _db_lock:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS scan_cursor ("
+            "  chain TEXT PRIMARY KEY,"
+            "  block_number INTEGER NOT NULL,"
+            "  log_index INTEGER"
+            ")"
+        )
+        # One row per relayed event, the primary key doubles as the (chain, tx_hash, event_index) index
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS relay_ledger ("
+            "  chain TEXT NOT NULL,"
+            "  tx_hash TEXT NOT NULL,"
+            "  event_index INTEGER NOT NULL,"
+            "  state TEXT NOT NULL,"
+            "  relay_tx_hash TEXT,"
+            "  attempts INTEGER NOT NULL DEFAULT 0,"
+            "  updated_at REAL NOT NULL,"
+            "  PRIMARY KEY (chain, tx_hash, event_index)"
+            ")"
+        )
+        # Ring buffer of recently scanned block hashes, used to find the fork point after a reorg
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS block_hashes ("
+            "  chain TEXT NOT NULL,"
+            "  block_number INTEGER NOT NULL,"
+            "  block_hash TEXT NOT NULL,"
+            "  PRIMARY KEY (chain, block_number)"
+            ")"
+        )
+        conn.commit()
+    return conn
+
+
+def load_cursor(conn, chain):
+    """
+        Returns the (block_number, log_index) position of the last processed event for chain,
+        or None if the chain has never been scanned.
+        A log_index of None means block_number has been fully processed.
+    """
+    with _db_lock:
+        row = conn.execute("SELECT block_number, log_index FROM scan_cursor WHERE chain = ?", (chain,)).fetchone()
+    if row is None:
+        return None
+    return row[0], row[1]
+
+
+def save_cursor(conn, chain, block_number, log_index=None):
+    """
+        Records that everything on chain up to (block_number, log_index) has been processed.
+        Pass log_index=None once the whole block has been processed.
+    """
+    with _db_lock:
+        conn.execute(
+            "INSERT INTO scan_cursor (chain, block_number, log_index) VALUES (?, ?, ?) "
+            "ON CONFLICT(chain) DO UPDATE SET block_number = excluded.block_number, log_index = excluded.log_index",
+            (chain, block_number, log_index)
+        )
+        conn.commit()
+
+
+def cursor_start_block(cursor):
+    """
+        Returns the first block that still has to be fetched for the given cursor
+    """
+    block_number, log_index = cursor
+    if log_index is None:
+        return block_number + 1
+    return block_number
+
+
+def is_processed(cursor, block_number, log_index):
+    """
+        True if the event at (block_number, log_index) is at or before the cursor
+    """
+    if cursor is None:
+        return False
+    cursor_block, cursor_log_index = cursor
+    if block_number != cursor_block:
+        return block_number < cursor_block
+    return cursor_log_index is None or log_index <= cursor_log_index
+
+
+def event_keys(events):
+    """
+        Returns the (tx_hash, event_index) that identifies each event of events in the relay ledger,
+        event_index being the position of the event among the events of the same transaction.
+        Unlike logIndex, which is numbered per block, the key survives the transaction being re-mined
+        in another block after a reorg.
+        events must be sorted by logIndex and hold every event of each of their transactions
+        (get_logs over whole blocks or process_receipt do)
+    """
+    keys = []
+    counts = {}
+    for event in events:
+        tx_hash = event['transactionHash'].hex()
+        event_index = counts.get(tx_hash, 0)
+        counts[tx_hash] = event_index + 1
+        keys.append((tx_hash, event_index))
+    return keys
+
+
+def ledger_state(conn, chain, key):
+    """
+        Returns the relay ledger state of the event key on chain, or None if it was never seen
+    """
+    tx_hash, event_index = key
+    with _db_lock:
+        row = conn.execute("SELECT state FROM relay_ledger WHERE chain = ? AND tx_hash = ? AND event_index = ?",
+                           (chain, tx_hash, event_index)).fetchone()
+    return None if row is None else row[0]
+
+
+def is_handled(conn, chain, key):
+    return ledger_state(conn, chain, key) in HANDLED_STATES
+
+
+def record_events(conn, chain, keys, state, relay_tx_hash=None):
+    """
+        Sets the relay ledger state of every event key in keys (on chain) in one transaction
+        Recording FAILED also counts one more failed attempt for each event
+    """
+    now = time.time()
+    attempts = 1 if state == FAILED else 0
+    rows = [(chain, tx_hash, event_index, state, relay_tx_hash, attempts, now) for tx_hash, event_index in keys]
+    with _db_lock:
+        conn.executemany(
+            "INSERT INTO relay_ledger (chain, tx_hash, event_index, state, relay_tx_hash, attempts, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(chain, tx_hash, event_index) DO UPDATE SET state = excluded.state, "
+            "relay_tx_hash = COALESCE(excluded.relay_tx_hash, relay_ledger.relay_tx_hash), "
+            "attempts = relay_ledger.attempts + excluded.attempts, updated_at = excluded.updated_at",
+            rows
+        )
+        conn.commit()
+
+
+def failed_events(conn, chain, max_attempts=MAX_RELAY_ATTEMPTS, backoff=RELAY_RETRY_BACKOFF):
+    """
+        Returns the (key, relay_tx_hash) of every FAILED event on chain that failed fewer than max_attempts times
+        and is due for a retry (its last failure is backoff * 2**(attempts - 1) seconds old), oldest first.
+        relay_tx_hash is the last relay transaction signed for the event, or None
+    """
+    with _db_lock:
+        rows = conn.execute("SELECT tx_hash, event_index, relay_tx_hash, attempts, updated_at FROM relay_ledger "
+                            "WHERE chain = ? AND state = ? AND attempts < ? ORDER BY updated_at",
+                            (chain, FAILED, max_attempts)).fetchall()
+    now = time.time()
+    return [((tx_hash, event_index), relay_tx_hash)
+            for tx_hash, event_index, relay_tx_hash, attempts, updated_at in rows
+            if updated_at <= now - backoff * 2 ** max(attempts - 1, 0)]
+
+
+def abandon_failed_events(conn, chain, max_attempts=MAX_RELAY_ATTEMPTS):
+    """
+        Moves the FAILED events on chain that failed max_attempts times to ABANDONED and returns their keys
+    """
+    with _db_lock:
+        rows = conn.execute("SELECT tx_hash, event_index FROM relay_ledger WHERE chain = ? AND state = ? AND attempts >= ?",
+                            (chain, FAILED, max_attempts)).fetchall()
+        conn.executemany("UPDATE relay_ledger SET state = ?, updated_at = ? WHERE chain = ? AND tx_hash = ? AND event_index = ?",
+                         [(ABANDONED, time.time(), chain, tx_hash, event_index) for tx_hash, event_index in rows])
+        conn.commit()
+    return [(tx_hash, event_index) for tx_hash, event_index in rows]
+
+
+def save_block_hash(conn, chain, block_number, block_hash, keep=REORG_BUFFER_SIZE):
+    """
+        Adds block_hash to the ring buffer of chain, dropping the oldest entries beyond keep
+    """
+    with _db_lock:
+        conn.execute("INSERT OR REPLACE INTO block_hashes (chain, block_number, block_hash) VALUES (?, ?, ?)",
+                     (chain, block_number, block_hash))
+        conn.execute(
+            "DELETE FROM block_hashes WHERE chain = ? AND block_number NOT IN "
+            "(SELECT block_number FROM block_hashes WHERE chain = ? ORDER BY block_number DESC LIMIT ?)",
+            (chain, chain, keep)
+        )
+        conn.commit()
+
+
+def recent_block_hashes(conn, chain):
+    """
+        Returns the buffered (block_number, block_hash) pairs of chain, newest first
+    """
+    with _db_lock:
+        return conn.execute("SELECT block_number, block_hash FROM block_hashes WHERE chain = ? ORDER BY block_number DESC",
+                            (chain,)).fetchall()
+
+
+def rewind(conn, chain, block_number):
+    """
+        Moves the cursor of chain back to the end of block_number (the fork point of a reorg)
+        and forgets the buffered hashes of the blocks after it
+    """
+    with _db_lock:
+        conn.execute("DELETE FROM block_hashes WHERE chain = ? AND block_number > ?", (chain, block_number))
+        conn.commit()
+    save_cursor(conn, chain, block_number)
+
+
+def stale_events(conn, chain, states=(SEEN, SUBMITTED), older_than=RELAY_STALE_TIMEOUT):
+    """
+        Returns the (key, state, relay_tx_hash) of every event on chain in one of states
+        that has not been updated for older_than seconds
+    """
+    with _db_lock:
+        rows = conn.execute("SELECT tx_hash, event_index, state, relay_tx_hash FROM relay_ledger "
+                            f"WHERE chain = ? AND state IN ({', '.join('?' * len(states))}) AND updated_at < ?",
+                            (chain, *states, time.time() - older_than)).fetchall()
+    return [((tx_hash, event_index), state, relay_tx_hash) for tx_hash, event_index, state, relay_tx_hash in rows]
@@ -2,6 +2,8 @@ import json
 import os
 from web3 import Web3, HTTPProvider
 
+from tx_manager import get_chain_context
+
 # No need to install_solc or use py-solc-x compilation here
 # since pre-compiled artifacts from Remix Desktop will be used.
 
@@ -11,7 +13,8 @@ def deploy_contract(w3, account, private_key, contract_artifact_filename, constr
     and returns its address and ABI.
     """
     contract_name = os.path.splitext(contract_artifact_filename)[0] # Extract name without .json extension
-    print(f"\n--- Deploying {contract_name} to chain ID {w3.eth.chain_id} ---")
+    chain_context = get_chain_context(w3) # chain_id and gas price are cached per connection
+    print(f"\n--- Deploying {contract_name} to chain ID {chain_context.chain_id} ---")
 
     # Construct the path to the artifact JSON file
     # Assumes artifacts folder is in the same directory as this script
@@ -38,22 +41,20 @@ def deploy_contract(w3, account, private_key, contract_artifact_filename, constr
     # Build the constructor arguments if any
     if constructor_args:
         transaction = Contract.constructor(*constructor_args).build_transaction({
-            'chainId': w3.eth.chain_id,
+            'chainId': chain_context.chain_id,
             'from': account.address,
             'nonce': nonce,
-            'gasPrice': w3.eth.gas_price
+            'gasPrice': chain_context.gas_price()
         })
     else:
         transaction = Contract.constructor().build_transaction({
-            'chainId': w3.eth.chain_id,
+            'chainId': chain_context.chain_id,
             'from': account.address,
             'nonce': nonce,
-            'gasPrice': w3.eth.gas_price
+            'gasPrice': chain_context.gas_price()
         })
 
-    # Estimate gas and update the transaction (optional but recommended)
-    gas_limit = w3.eth.estimate_gas(transaction)
-    transaction['gas'] = gas_limit
+    # build_transaction has already filled in the gas estimate, no need for a second estimate_gas call
 
     # Sign the transaction with your private key
     signed_txn = w3.eth.account.sign_transaction(transaction, private_key=private_key)
@@ -1,6 +1,20 @@
 #!/bin/python
+import array
 import hashlib
+import multiprocessing
+import os
+import queue
 import random
+from concurrent.futures import ThreadPoolExecutor
+
+# Nonces searched between checks for a result, in mine_block and by each mine_block_parallel worker
+NONCE_CHUNK_SIZE = 1 << 14
+
+# prev_hash of the first block mined by mine_chain
+GENESIS_PREV_HASH = b'0' * 64
+
+# Line offset index of each file read by sample_random_lines: path -> ((size, mtime), offsets)
+_line_offsets_cache = {}
 
 
 def mine_block(k, prev_hash, transactions):
@@ -20,24 +34,166 @@ def mine_block(k, prev_hash, transactions):
     # TODO your code to find a nonce here
 
     transactions_data = b''.join(t.encode('utf-8') for t in transactions)
-    nonce_count = 0
+    nonce = mine_prefix(k, prev_hash + transactions_data)
 
+    assert isinstance(nonce, bytes), 'nonce should be of type bytes'
+    return nonce
+
+
+def mine_prefix(k, prefix, processes=1):
+    """
+        Returns a nonce such that sha256( prefix + nonce ) has k trailing zero bits
+        With processes > 1 the search is split across worker processes (see mine_block_parallel),
+        otherwise the smallest such nonce is returned
+    """
+    if processes > 1:
+        return _mine_prefix_parallel(k, prefix, processes)
+
+    nonce_count = 0
     while True:
 
-        nonce = str(nonce_count).encode(('utf-8'))
-        data_bytes = prev_hash + transactions_data + nonce
-        current_hash = hashlib.sha256(data_bytes).digest()
-        hash_int = int.from_bytes(current_hash, 'big')
+        nonce = search_nonces(k, prefix, nonce_count, nonce_count + NONCE_CHUNK_SIZE)
+        if nonce is not None:
+            return nonce
+
+        nonce_count += NONCE_CHUNK_SIZE
+
+
+def search_nonces(k, prefix, start, stop):
+    """
+        Returns the first nonce (as bytes) in [start, stop) such that sha256( prefix + nonce )
+        has k trailing zero bits, or None
+
+        prefix is hashed once and the hasher state is copied for every nonce, so the cost per
+        nonce does not depend on the size of the block; the trailing zeros are checked on the
+        last bytes of the digest without converting it to an int
+    """
+    prefix_hasher = hashlib.sha256(prefix)
+    zero_bytes, zero_bits = divmod(k, 8)
+    zero_tail = bytes(zero_bytes)
+    bits_mask = (1 << zero_bits) - 1
+    last_byte = -zero_bytes - 1
+
+    for nonce_count in range(start, stop):
+
+        nonce = str(nonce_count).encode('utf-8')
+        hasher = prefix_hasher.copy()
+        hasher.update(nonce)
+        current_hash = hasher.digest()
 
-        if (hash_int & ((1 << k) - 1)) == 0:
-            break
+        if current_hash.endswith(zero_tail) and not (current_hash[last_byte] & bits_mask):
+            return nonce
 
-        nonce_count += 1
+    return None
+
+
+def mine_block_parallel(k, prev_hash, transactions, processes=None):
+    """
+        Same as mine_block, but the nonce space is split into chunks of NONCE_CHUNK_SIZE nonces
+        that are searched by processes worker processes (one per core by default); every worker
+        stops as soon as one of them finds a valid nonce.
+        The nonce returned is valid but, unlike mine_block, not necessarily the smallest one
+    """
+    if not isinstance(k, int) or k < 0:
+        print("mine_block expects positive integer")
+        return b'\x00'
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    transactions_data = b''.join(t.encode('utf-8') for t in transactions)
+    nonce = mine_prefix(k, prev_hash + transactions_data, processes)
 
     assert isinstance(nonce, bytes), 'nonce should be of type bytes'
     return nonce
 
 
+def _mine_prefix_parallel(k, prefix, processes):
+    found = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_mine_worker, args=(k, prefix, worker, processes, found, results),
+                                       daemon=True)
+               for worker in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        nonce = None
+        while nonce is None:
+            try:
+                nonce = results.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("All mining workers exited without finding a nonce")
+    finally:
+        found.set()
+        for worker in workers:
+            worker.join()
+
+    return nonce
+
+
+def _mine_worker(k, prefix, worker, processes, found, results):
+    """
+        Worker for mine_block_parallel: searches chunks worker, worker + processes, ... of the
+        nonce space until a nonce is found (by this or any other worker)
+    """
+    chunk = worker
+    while not found.is_set():
+        start = chunk * NONCE_CHUNK_SIZE
+        nonce = search_nonces(k, prefix, start, start + NONCE_CHUNK_SIZE)
+        if nonce is not None:
+            found.set()
+            results.put(nonce)
+            return
+        chunk += processes
+
+
+def mine_chain(k, transaction_batches, prev_hash=GENESIS_PREV_HASH, processes=1):
+    """
+        Mines a chain of blocks, one per batch of transactions (list of strings) taken from the
+        iterable transaction_batches, and yields (prev_hash, nonce, block_hash) for every block.
+        block_hash is the hex sha256 of the block (as bytes, like prev_hash) and is the prev_hash
+        of the next block.
+
+        While block i is being mined, a background thread already pulls batch i+1 from
+        transaction_batches (e.g. sampling lines from a file) and encodes its payload. Only the
+        hashing has to wait for block i: prev_hash comes first in the block so the prefix of
+        block i+1 cannot be hashed before block i is mined.
+    """
+    if not isinstance(k, int) or k < 0:
+        print("mine_chain expects positive integer")
+        return
+
+    def prepare(batches):
+        for transactions in batches:
+            yield b''.join(t.encode('utf-8') for t in transactions)
+
+    payloads = prepare(transaction_batches)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_payload = executor.submit(next, payloads, None)
+        while True:
+            transactions_data = next_payload.result()
+            if transactions_data is None:
+                return
+            next_payload = executor.submit(next, payloads, None)
+
+            prefix = prev_hash + transactions_data
+            nonce = mine_prefix(k, prefix, processes)
+            block_hash = hashlib.sha256(prefix + nonce).hexdigest().encode('utf-8')
+
+            yield prev_hash, nonce, block_hash
+            prev_hash = block_hash
+
+
+def random_transaction_batches(filename, num_lines, num_blocks):
+    """
+        Yields num_blocks batches of num_lines random lines of filename, e.g. for mine_chain
+    """
+    for _ in range(num_blocks):
+        yield sample_random_lines(filename, num_lines)
+
+
 def get_random_lines(filename, quantity):
     """
     This is a helper function to get the quantity of lines ("transactions")
@@ -55,6 +211,48 @@ def get_random_lines(filename, quantity):
     return random_lines
 
 
+def sample_random_lines(filename, quantity):
+    """
+        Returns quantity lines ("transactions") picked uniformly at random (with replacement)
+        from the whole file, stripped like get_random_lines does.
+        The file is indexed once (the byte offset of every line, see get_line_offsets), after that
+        each call only seeks to and reads the lines it picks, so memory per call is O(quantity)
+        however large the file is
+    """
+    offsets = get_line_offsets(filename)
+    if len(offsets) == 0:
+        return []
+
+    random_lines = []
+    with open(filename, 'rb') as f:
+        for x in range(quantity):
+            f.seek(offsets[random.randrange(len(offsets))])
+            random_lines.append(f.readline().decode('utf-8').strip())
+    return random_lines
+
+
+def get_line_offsets(filename):
+    """
+        Returns the byte offset of every line of filename (as an array of uint64)
+        The index is built in one streaming pass and cached until the file changes
+    """
+    stat = os.stat(filename)
+    key = os.path.abspath(filename)
+    cached = _line_offsets_cache.get(key)
+    if cached is not None and cached[0] == (stat.st_size, stat.st_mtime_ns):
+        return cached[1]
+
+    offsets = array.array('Q')
+    position = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            offsets.append(position)
+            position += len(line)
+
+    _line_offsets_cache[key] = ((stat.st_size, stat.st_mtime_ns), offsets)
+    return offsets
+
+
 if __name__ == '__main__':
     # This code will be helpful for your testing
     filename = "bitcoin_text.txt"
@@ -66,7 +264,7 @@ if __name__ == '__main__':
     diff = 20
     prev_hash = b'0000000000000000000000000000000000000000000000000000000000000000'
 
-    transactions = get_random_lines(filename, num_lines)
+    transactions = sample_random_lines(filename, num_lines)
     #print(transactions)
     nonce = mine_block(diff, prev_hash, transactions)
     print(nonce)
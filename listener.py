@@ -1,13 +1,76 @@
+import csv
 import os
+import time
 
 from web3 import Web3
 from web3.providers.rpc import HTTPProvider
 from web3.middleware import ExtraDataToPOAMiddleware #Necessary for POA chains
+from web3.exceptions import Web3RPCError
+from requests.exceptions import Timeout
 from pathlib import Path
 import json
 from datetime import datetime
-import pandas as pd
 
+# Block range requested per eth_getLogs call, adapted while scanning
+INITIAL_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 10000
+
+# Error messages providers use when an eth_getLogs range spans too many blocks or returns too many logs
+RANGE_LIMIT_MESSAGES = ["query returned more than", "too many results", "block range", "range too large",
+                        "range is too large", "response size exceeded", "logs matched by query exceeds",
+                        "exceed maximum block range"]
+# Rate limited or timed out calls are retried this many times, waiting GET_LOGS_BACKOFF * 2**attempt seconds
+GET_LOGS_RETRIES = 5
+GET_LOGS_BACKOFF = 1.0
+
+# Deposit rows are buffered and written once either limit is reached
+CSV_FIELDS = ["chain", "token", "recipient", "amount", "transactionHash", "address"]
+FLUSH_EVERY_ROWS = 500
+FLUSH_EVERY_SECONDS = 5.0
+
+
+class DepositLogWriter:
+    """
+    Streaming CSV sink for decoded Deposit events.
+
+    Keeps one file handle open for the whole scan, accumulates rows and writes
+    them in batches (every flush_rows rows or flush_seconds seconds). The header
+    is written exactly once, when the file is new or empty.
+    """
+
+    def __init__(self, eventfile, flush_rows=FLUSH_EVERY_ROWS, flush_seconds=FLUSH_EVERY_SECONDS):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.last_flush = time.monotonic()
+
+        header = not os.path.exists(eventfile) or os.path.getsize(eventfile) == 0
+        self.file = open(eventfile, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+        if header:
+            self.writer.writeheader()
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows = []
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 def scan_blocks(chain, start_block, end_block, contract_address, eventfile='deposit_logs.csv'):
     """
@@ -52,54 +115,75 @@ def scan_blocks(chain, start_block, end_block, contract_address, eventfile='depo
     else:
         print( f"Scanning blocks {start_block} - {end_block} on {chain}" )
 
-    # Check Header
-    file_exists = os.path.exists(eventfile)
-    header = not file_exists
-
-    if end_block - start_block < 30:
-        event_filter = contract.events.Deposit.create_filter(from_block=start_block,to_block=end_block,argument_filters=arg_filter)
-        events = event_filter.get_all_entries()
-        #print( f"Got {len(events)} entries for block {block_num}" )
-        # TODO YOUR CODE HERE
-
-        for evt in events:
-            data = {
+    with DepositLogWriter(eventfile) as writer:
+        for evt in get_deposit_logs(contract, start_block, end_block, argument_filters=arg_filter):
+            writer.write({
                 "chain": chain,
                 "token": evt.args.token,
                 "recipient": evt.args.recipient,
                 "amount": evt.args.amount,
                 "transactionHash": evt.transactionHash.hex(),
                 "address": evt.address,
-            }
-            df_event = pd.DataFrame([data])
-            #df_event.to_csv(eventfile, mode='a', index=False, header=False)
-            df_event.to_csv(eventfile, mode='a', index=False, header=header)
-            if header:
-                header = False
+            })
 
-    else:
-        for block_num in range(start_block,end_block+1):
-            event_filter = contract.events.Deposit.create_filter(from_block=block_num,to_block=block_num,argument_filters=arg_filter)
-            events = event_filter.get_all_entries()
-            #print( f"Got {len(events)} entries for block {block_num}" )
-            # TODO YOUR CODE HERE
-
-            for evt in events:
-                data = {
-                    "chain": chain,
-                    "token": evt.args.token,
-                    "recipient": evt.args.recipient,
-                    "amount": evt.args.amount,
-                    "transactionHash": evt.transactionHash.hex(),
-                    "address": evt.address,
-                }
-                df_event = pd.DataFrame([data])
-                #df_event.to_csv(eventfile, mode='a', index=False, header=False)
-                df_event.to_csv(eventfile, mode='a', index=False, header=header)
-                if header:
-                    header = False
+def get_deposit_logs(contract, start_block, end_block, argument_filters=None,
+                     initial_chunk_size=INITIAL_CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE):
+    """
+    contract - contract object with the Deposit event in its ABI
+    start_block - integer first block to fetch
+    end_block - integer last block to fetch (inclusive)
+
+    Yields the Deposit logs between start_block and end_block in order, fetching
+    large block ranges with a single eth_getLogs call. When the provider rejects a
+    range (too many results / range too large) or the call times out, the range is
+    halved and retried, and after every successful call the range is doubled again
+    up to max_chunk_size. Rate limited calls (and timeouts of a single block) are
+    retried with exponential backoff, any other error is raised.
+    """
+    chunk_size = max(1, min(initial_chunk_size, max_chunk_size))
+    from_block = start_block
+    retries = 0
+
+    while from_block <= end_block:
+        to_block = min(end_block, from_block + chunk_size - 1)
+        try:
+            events = contract.events.Deposit.get_logs(argument_filters=argument_filters,
+                                                      from_block=from_block, to_block=to_block)
+        except (Web3RPCError, ValueError, Timeout) as e:
+            if (is_range_limit_error(e) or isinstance(e, Timeout)) and to_block > from_block:
+                chunk_size = max(1, (to_block - from_block + 1) // 2)
+                #print( f"Range {from_block} - {to_block} rejected ({e}), retrying with {chunk_size} blocks" )
+                continue
+            if (is_rate_limited(e) or isinstance(e, Timeout)) and retries < GET_LOGS_RETRIES:
+                time.sleep(GET_LOGS_BACKOFF * 2 ** retries)
+                retries += 1
+                continue
+            raise
+
+        #print( f"Got {len(events)} entries for blocks {from_block} - {to_block}" )
+        for evt in events:
+            yield evt
 
+        from_block = to_block + 1
+        chunk_size = min(max_chunk_size, chunk_size * 2)
+        retries = 0
 
 
+def is_range_limit_error(error):
+    """
+    True if error is the provider refusing an eth_getLogs range for spanning too many
+    blocks or matching too many logs
+    """
+    message = str(error).lower()
+    return any(limit_message in message for limit_message in RANGE_LIMIT_MESSAGES)
 
 
+def is_rate_limited(error):
+    """
+    True if error is the provider rejecting a call for exceeding its rate limit
+    """
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    message = str(error).lower()
+    return "rate limit" in message or "too many requests" in message
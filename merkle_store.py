@@ -0,0 +1,123 @@
+"""
+    On-disk Merkle tree format, one file per tree (all integers little-endian uint64):
+
+        magic          8 bytes   b'MRKLTREE'
+        leaf_count     number of leaves the tree was built from
+        num_levels     number of levels, leaves included
+        level_sizes    num_levels integers, number of 32-byte nodes stored per level
+        nodes          every level back to back (leaves first, root last), 32 bytes per node
+
+    Levels are stored exactly as build_merkle returns them (including the duplicated last node of
+    odd levels), so proofs read from the file match prove_merkle byte for byte.
+"""
+import bisect
+import mmap
+import os
+import struct
+
+MAGIC = b'MRKLTREE'
+NODE_SIZE = 32
+
+
+def write_merkle_store(path, tree, leaf_count=None):
+    """
+        Writes a tree returned by build_merkle to path
+        leaf_count is the number of leaves before build_merkle padded odd levels
+    """
+    if leaf_count is None:
+        leaf_count = len(tree[0])
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack(f'<{2 + len(tree)}Q', leaf_count, len(tree), *[len(level) for level in tree]))
+        for level in tree:
+            f.write(b''.join(level))
+    # Readers never see a half written tree
+    os.replace(tmp_path, path)
+
+
+class _Level:
+    """
+        Read-only sequence view of one level of the memory-mapped tree, so bisect can search the
+        sorted leaves without loading them
+    """
+
+    def __init__(self, data, offset, size):
+        self.data = data
+        self.offset = offset
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        start = self.offset + index * NODE_SIZE
+        return self.data[start:start + NODE_SIZE]
+
+
+class MerkleStore:
+    """
+        Memory-mapped Merkle tree written by write_merkle_store
+        Opening is O(1) regardless of the tree size; leaf lookups are a binary search over the
+        sorted leaves and proofs read one sibling per level, so both are O(log n) with no hashing
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Merkle tree file")
+
+        offset = len(MAGIC)
+        self.leaf_count, num_levels = struct.unpack_from('<2Q', self.data, offset)
+        offset += 16
+        level_sizes = struct.unpack_from(f'<{num_levels}Q', self.data, offset)
+        offset += 8 * num_levels
+
+        self.levels = []
+        for size in level_sizes:
+            self.levels.append(_Level(self.data, offset, size))
+            offset += size * NODE_SIZE
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    def leaf(self, index):
+        return self.levels[0][index]
+
+    def leaf_index(self, leaf):
+        """
+            Returns the index of leaf (bytes32) in the sorted leaves, or None if it is not in the tree
+        """
+        leaves = self.levels[0]
+        index = bisect.bisect_left(leaves, leaf)
+        if index < self.leaf_count and leaves[index] == leaf:
+            return index
+        return None
+
+    def prove(self, index):
+        """
+            Returns the proof of inclusion of the leaf at index, same as prove_merkle
+        """
+        merkle_proof = []
+        for level in self.levels[:-1]:
+            sibling_index = index + 1 if index % 2 == 0 else index - 1
+            if sibling_index < len(level):
+                merkle_proof.append(level[sibling_index])
+            index //= 2
+        return merkle_proof
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,10 +1,22 @@
 import random
 import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from web3 import Web3
 from web3.middleware import ExtraDataToPOAMiddleware
 from web3.providers.rpc import HTTPProvider
 
+# Blocks fetched concurrently by analyze_blocks
+ANALYZER_WORKERS = 8
+# Retries of a rate limited call, waiting RATE_LIMIT_BACKOFF * 2**attempt seconds (plus jitter) between them
+RATE_LIMIT_RETRIES = 6
+RATE_LIMIT_BACKOFF = 0.5
+# JSON-RPC error code providers use for "limit exceeded"
+RATE_LIMIT_RPC_CODE = -32005
+
 
 # If you use one of the suggested infrastructure providers, the url will be of the form
 # now_url  = f"https://eth.nownodes.io/{now_token}"
@@ -49,7 +61,7 @@ def connect_with_middleware(contract_json):
 	return w3, contract
 
 
-def is_ordered_block(w3, block_num):
+def is_ordered_block(w3, block_num, fetch_missing=True):
 	"""
 	Takes a block number
 	Returns a boolean that tells whether all the transactions in the block are ordered by priority fee
@@ -61,63 +73,192 @@ def is_ordered_block(w3, block_num):
 		*Type 2* The priority fee is min( tx.maxPriorityFeePerGas, tx.maxFeePerGas - block.baseFeePerGas )
 
 	Conveniently, most type 2 transactions set the gasPrice field to be min( tx.maxPriorityFeePerGas + block.baseFeePerGas, tx.maxFeePerGas )
-	"""
-
-	block = w3.eth.get_block(block_num, full_transactions=True)
 
-	ordered = True
+	The fees are read from the transactions returned with the block (full_transactions=True), so a block
+	costs a single RPC call. If fetch_missing is set, transactions that lack the needed fields are priced
+	from the effectiveGasPrice of their receipts, fetched in one JSON-RPC batch.
+	"""
 
 	# TODO YOUR CODE HERE
 
-	count = 0
+	ordered = block_ordering(w3, block_num, fetch_missing)['ordered']
 
-	try:
-		if block['baseFeePerGas'] is not None:
-			base_fee = block['baseFeePerGas']
-		else:
-			base_fee = 0
-	except Exception as e:
-		base_fee = 0
+	return ordered
 
-	previous_fee = float('inf')
 
-	for transaction in block.transactions:
+def block_ordering(w3, block_num, fetch_missing=True):
+	"""
+	Returns the details of the ordering check of is_ordered_block as a dictionary:
+		block            the block number
+		ordered          True if the transactions are sorted in decreasing order of priority fee
+		base_fee         block.baseFeePerGas (0 before London)
+		tx_count         number of transactions in the block
+		first_violation  index of the first transaction paying more than the one before it, or None
+	"""
+	block = w3.eth.get_block(block_num, full_transactions=True)
 
-		count = count + 1
-		#print(f"count: {count}")
+	base_fee = block.get('baseFeePerGas') or 0
 
-		tx_hash = transaction['hash']
-		tx = w3.eth.get_transaction(tx_hash)
+	first_violation = None
+	previous_fee = float('inf')
 
-		if transaction['type'] == 2:
-			if 'maxPriorityFeePerGas' in tx:
-				priority_fee = min( tx.maxPriorityFeePerGas, tx.maxFeePerGas - base_fee )
-				#print(f"type 2: {priority_fee}")
-			else:
-				priority_fee = tx.gasPrice - base_fee
-				
-		else:
-			if transaction['type'] == 0 or transaction['type'] == 1:
-				priority_fee = tx.gasPrice - base_fee
-				#print(f"type 0 or 1: {priority_fee}")
-			else:
-				try:
-					if tx.gasPrice is not None:
-						priority_fee = tx.gasPrice
-					else:
-						priority_fee = 0
-				except Exception as e:
-					priority_fee = 0
-
-				#print(f"error, no transaction type found at: {count}")
-
-		current_fee = priority_fee
+	for index, current_fee in enumerate(block_priority_fees(w3, block, base_fee, fetch_missing)):
 		if current_fee > previous_fee:
-			ordered = False
-			return ordered
+			first_violation = index
+			break
 		previous_fee = current_fee
 
-	return ordered
+	return {
+		'block': block_num,
+		'ordered': first_violation is None,
+		'base_fee': base_fee,
+		'tx_count': len(block.transactions),
+		'first_violation': first_violation,
+	}
+
+
+def priority_fee(tx, base_fee):
+	"""
+	Returns the priority fee of the transaction object tx (as returned by get_block or get_transaction),
+	or None if tx does not have the fields needed to compute it
+	"""
+	tx_type = tx.get('type')
+	gas_price = tx.get('gasPrice')
+
+	if tx_type == 2:
+		if tx.get('maxPriorityFeePerGas') is not None and tx.get('maxFeePerGas') is not None:
+			return min( tx['maxPriorityFeePerGas'], tx['maxFeePerGas'] - base_fee )
+		if gas_price is None:
+			return None
+		return gas_price - base_fee
+
+	if tx_type == 0 or tx_type == 1:
+		if gas_price is None:
+			return None
+		return gas_price - base_fee
+
+	if gas_price is not None:
+		return gas_price
+	return 0
+
+
+def block_priority_fees(w3, block, base_fee, fetch_missing=True):
+	"""
+	Returns the priority fees of the transactions of block (fetched with full_transactions=True), in block order
+	Transactions whose fee cannot be computed are priced from their receipt (effectiveGasPrice - base fee),
+	all such receipts are requested in a single JSON-RPC batch
+	"""
+	fees = [priority_fee(tx, base_fee) for tx in block.transactions]
+
+	missing = [i for i, fee in enumerate(fees) if fee is None]
+	if missing and fetch_missing:
+		with w3.batch_requests() as batch:
+			for i in missing:
+				batch.add(w3.eth.get_transaction_receipt(block.transactions[i]['hash']))
+			receipts = batch.execute()
+		for i, receipt in zip(missing, receipts):
+			fees[i] = receipt['effectiveGasPrice'] - base_fee
+
+	# Transactions that could not be priced count as a zero priority fee
+	return [0 if fee is None else fee for fee in fees]
+
+
+def is_rate_limited(error):
+	"""
+	True if error is the provider rejecting a request for exceeding its rate limit: an HTTP 429 response,
+	a JSON-RPC error with code -32005, or an error message that says so explicitly
+	"""
+	response = getattr(error, 'response', None)
+	if getattr(response, 'status_code', None) == 429:
+		return True
+	rpc_response = getattr(error, 'rpc_response', None)
+	if isinstance(rpc_response, dict) and isinstance(rpc_response.get('error'), dict):
+		if rpc_response['error'].get('code') == RATE_LIMIT_RPC_CODE:
+			return True
+	message = str(error).lower()
+	return 'rate limit' in message or 'too many requests' in message
+
+
+def with_backoff(fn, *args, retries=RATE_LIMIT_RETRIES, backoff=RATE_LIMIT_BACKOFF):
+	"""
+	Calls fn(*args), retrying with exponential backoff and jitter while the provider rate limits it
+	"""
+	for attempt in range(retries + 1):
+		try:
+			return fn(*args)
+		except Exception as e:
+			if attempt == retries or not is_rate_limited(e):
+				raise
+			time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+def _check_block(w3, block_num, fetch_missing):
+	try:
+		return with_backoff(block_ordering, w3, block_num, fetch_missing)
+	except Exception as e:
+		return {'block': block_num, 'error': str(e)}
+
+
+def analyze_blocks(w3, block_nums, max_workers=ANALYZER_WORKERS, fetch_missing=True):
+	"""
+	Runs block_ordering on every block of the iterable block_nums (e.g. range(start, end + 1)) with up to
+	max_workers requests in flight, and yields the results in the order of block_nums as soon as they are ready.
+	A block that could not be checked yields {'block': block_num, 'error': message} instead.
+	At most 2 * max_workers blocks are queued at once, so block_nums can be arbitrarily long.
+	"""
+	block_nums = iter(block_nums)
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		pending = deque()
+		for block_num in block_nums:
+			pending.append(executor.submit(_check_block, w3, block_num, fetch_missing))
+			if len(pending) >= 2 * max_workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+
+
+class OrderingStats:
+	"""
+	Aggregates the results yielded by analyze_blocks
+	"""
+
+	def __init__(self):
+		self.blocks = 0
+		self.ordered = 0
+		self.errors = 0
+		self.tx_count = 0
+		self.base_fee = 0
+		self.empty = 0
+		self.violation_indices = []
+
+	def add(self, result):
+		if 'error' in result:
+			self.errors += 1
+			return
+		self.blocks += 1
+		self.tx_count += result['tx_count']
+		self.base_fee += result['base_fee']
+		if result['tx_count'] == 0:
+			self.empty += 1
+		if result['ordered']:
+			self.ordered += 1
+		else:
+			self.violation_indices.append(result['first_violation'])
+
+	def summary(self):
+		checked = max(self.blocks, 1)
+		violations = sorted(self.violation_indices)
+		return {
+			'blocks': self.blocks,
+			'errors': self.errors,
+			'ordered': self.ordered,
+			'unordered': self.blocks - self.ordered,
+			'ordered_fraction': self.ordered / checked,
+			'empty_blocks': self.empty,
+			'mean_tx_count': self.tx_count / checked,
+			'mean_base_fee': self.base_fee / checked,
+			'median_first_violation': violations[len(violations) // 2] if violations else None,
+		}
 
 
 def get_contract_values(contract, admin_address, owner_address):
@@ -171,22 +312,24 @@ if __name__ == "__main__":
 	london_hard_fork_block_num = 12965000
 	assert latest_block > london_hard_fork_block_num, f"Error: the chain never got past the London Hard Fork"
 
-	n = 5
-	for _ in range(n):
-		block_num = random.randint(1, latest_block)
-
-		# for debug
-		#try:
-		#	transaction_count = eth_w3.eth.get_block_transaction_count(block_num)
-		#	print(f"Transaction Count: {transaction_count}")
-		#except Exception as e:
-		#	print(f"Error getting transaction count: {e}")
-
-		ordered = is_ordered_block(eth_w3, block_num)
-		if ordered:
+	# python reading_the_chain.py START END analyzes every block in [START, END], otherwise n random blocks are sampled
+	if len(sys.argv) == 3:
+		block_nums = range(int(sys.argv[1]), int(sys.argv[2]) + 1)
+	else:
+		n = 5
+		block_nums = [random.randint(1, latest_block) for _ in range(n)]
+
+	stats = OrderingStats()
+	for result in analyze_blocks(eth_w3, block_nums):
+		stats.add(result)
+		block_num = result['block']
+		if 'error' in result:
+			print(f"Block {block_num} could not be checked: {result['error']}")
+		elif result['ordered']:
 			print(f"Block {block_num} is ordered")
 		else:
-			print(f"Block {block_num} is not ordered")
+			print(f"Block {block_num} is not ordered (transaction {result['first_violation']} of {result['tx_count']})")
+	print(json.dumps(stats.summary()))
 
 	# for debug
 	onchain_root, has_role, prime = get_contract_values(contract, admin_address, owner_address)
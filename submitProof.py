@@ -1,11 +1,46 @@
 import eth_account
+import math
+import os
 import random
 import string
+import time
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from eth_hash.auto import keccak
 from web3 import Web3
+from web3.exceptions import ContractLogicError
 from web3.middleware import ExtraDataToPOAMiddleware  # Necessary for POA chains
 
+from merkle_store import MerkleStore, write_merkle_store
+
+try:
+    import numpy as np  # Vectorizes the prime sieve, a pure Python sieve is used without it
+except ImportError:
+    np = None
+
+# Numbers sieved at a time by sieve_primes
+SIEVE_SEGMENT_SIZE = 1 << 18
+
+# build_merkle only hashes the lower levels in parallel for trees at least this large
+PARALLEL_BUILD_THRESHOLD = 1 << 16
+MIN_SUBTREE_DEPTH = 10
+
+# Seconds the on-chain merkleRoot is cached by get_merkle_root
+ROOT_CACHE_TTL = 300
+_merkle_root_cache = {}  # contract address -> (root, time fetched)
+
+# Claim events are read in ranges of this many blocks, starting the first time at CLAIM_SCAN_START_BLOCK,
+# or at the block the contract was deployed in (found with find_deployment_block) if it is None
+CLAIM_LOG_CHUNK_SIZE = 5000
+CLAIM_SCAN_START_BLOCK = None
+# The contract event emitted for a claim and its bytes32/uint256 argument holding the claimed leaf (or prime).
+# Until both are set ClaimedLeaves.refresh does nothing and the bitmap only learns from failed claims
+CLAIM_EVENT = None
+CLAIM_EVENT_ARG = None
+# Leaves known to be claimed before any event is read (leaf 0 is claimed by the contract owner)
+KNOWN_CLAIMED_LEAVES = (0,)
+
 
 def merkle_assignment():
     """
@@ -14,20 +49,22 @@ def merkle_assignment():
         ready to attempt to claim a prime. You will need to complete the
         methods called by this method to generate the proof.
     """
-    # Generate the list of primes as integers
+    # Open the Merkle tree of the first num_of_primes primes (in bytes32 format),
+    # it is only generated and built the first time
     num_of_primes = 8192
-    primes = generate_primes(num_of_primes)
-
-    # Create a version of the list of primes in bytes32 format
-    leaves = convert_leaves(primes)
+    tree = get_merkle_store(num_of_primes)
 
-    # Build a Merkle tree using the bytes32 leaves as the Merkle tree's leaves
-    tree = build_merkle(leaves)
-
-    # Select a random leaf and create a proof for that leaf
+    # Select a random leaf that has not been claimed yet and create a proof for that leaf
     #random_leaf_index = 0 #TODO generate a random index from primes to claim (0 is already claimed)
-    random_leaf_index = random.randrange(len(leaves))
-    proof = prove_merkle(tree, random_leaf_index)
+    claimed = ClaimedLeaves(tree)
+    if CLAIM_EVENT is not None:
+        try:
+            address, abi = get_contract_info('bsc')
+            claimed.refresh(connect_to('bsc'), address, abi)
+        except Exception as e:
+            print(f"Could not update the claimed leaves, sampling from the last known state: {e}")
+    random_leaf_index = claimed.random_free_index()
+    proof = tree.prove(random_leaf_index)
 
     # This is the same way the grader generates a challenge for sign_challenge()
     challenge = ''.join(random.choice(string.ascii_letters) for i in range(32))
@@ -39,7 +76,7 @@ def merkle_assignment():
 
         # TODO, when you are ready to attempt to claim a prime (and pay gas fees),
         #  complete this method and run your code with the following line un-commented
-        tx_hash = send_signed_msg(proof, leaves[random_leaf_index])
+        tx_hash = send_signed_msg(proof, tree.leaf(random_leaf_index), claimed)
 
 
 def generate_primes(num_primes):
@@ -47,34 +84,74 @@ def generate_primes(num_primes):
         Function to generate the first 'num_primes' prime numbers
         returns list (with length n) of primes (as ints) in ascending order
     """
-    primes_list = []
-
-    #TODO YOUR CODE HERE
     if num_primes <= 0:
         return []
 
-    num = 2
+    # Segmented Sieve of Eratosthenes up to an upper bound on the num_primes-th prime
+    primes_list = sieve_primes(prime_upper_bound(num_primes))
 
-    while len(primes_list) < num_primes:
+    return primes_list[:num_primes]
 
-        is_prime = True
 
-        if num < 2:
-            is_prime = False
-        else:
-            for i in range(2, int(num ** 0.5) + 1):
-                if num % i == 0:
-                    is_prime = False
-                    break
+def prime_upper_bound(n):
+    """
+        Upper bound on the n-th prime from the prime number theorem:
+        p_n < n * (ln n + ln ln n) for n >= 6
+    """
+    if n < 6:
+        return 15
+    return int(n * (math.log(n) + math.log(math.log(n)))) + 1
 
-        if is_prime:
-            primes_list.append(num)
 
-        num += 1
+def sieve_primes(limit, segment_size=SIEVE_SEGMENT_SIZE):
+    """
+        Returns all primes <= limit (as ints) in ascending order
+        The base primes up to sqrt(limit) are sieved first, then the range is sieved
+        in segments of segment_size numbers so memory stays bounded for large limits
+    """
+    if limit < 2:
+        return []
+
+    # Every composite <= limit has a prime factor <= sqrt(limit)
+    base_primes = sieve_primes(math.isqrt(limit), segment_size)
+
+    primes_list = []
+    for low in range(2, limit + 1, segment_size):
+        high = min(low + segment_size - 1, limit)
+        primes_list.extend(_sieve_segment(low, high, base_primes))
 
     return primes_list
 
 
+def _sieve_segment(low, high, base_primes):
+    """
+        Returns the numbers in [low, high] that are not multiples of any of base_primes
+        (other than the prime itself), i.e. the primes in the range when base_primes
+        holds every prime <= sqrt(high)
+    """
+    size = high - low + 1
+    if size <= 0:
+        return []
+
+    if np is not None:
+        is_prime = np.ones(size, dtype=bool)
+    else:
+        is_prime = bytearray(b'\x01') * size
+
+    for p in base_primes:
+        if p * p > high:
+            break
+        start = max(p * p, ((low + p - 1) // p) * p)
+        if np is not None:
+            is_prime[start - low::p] = False
+        else:
+            is_prime[start - low::p] = bytes(len(range(start - low, size, p)))
+
+    if np is not None:
+        return (np.flatnonzero(is_prime) + low).tolist()
+    return [low + i for i in range(size) if is_prime[i]]
+
+
 def convert_leaves(primes_list):
     """
         Converts the leaves (primes_list) to bytes32 format
@@ -99,12 +176,15 @@ def convert_leaves(primes_list):
     return primes_bytes32_list
 
 
-def build_merkle(leaves):
+def build_merkle(leaves, processes=1):
     """
         Function to build a Merkle Tree from the list of prime numbers in bytes32 format
         Returns the Merkle tree (tree) as a list where tree[0] is the list of leaves,
         tree[1] is the parent hashes, and so on until tree[n] which is the root hash
         the root hash produced by the "hash_pair" helper function
+
+        processes - number of worker processes for the lower levels (None for one per core),
+        trees with fewer than PARALLEL_BUILD_THRESHOLD leaves are always built serially
     """
 
     #TODO YOUR CODE HERE
@@ -117,18 +197,16 @@ def build_merkle(leaves):
 
     tree.append(sorted_leaves)
 
-    current_level = sorted_leaves
+    if processes != 1 and len(sorted_leaves) >= PARALLEL_BUILD_THRESHOLD:
+        tree.extend(build_lower_levels(sorted_leaves, processes))
+
+    current_level = tree[-1]
     while len(current_level) > 1:
-        next_level = []
 
         if len(current_level) % 2 != 0:
             current_level.append(current_level[-1])
 
-        for i in range(0, len(current_level), 2):
-            left_child = current_level[i]
-            right_child = current_level[i + 1]
-            parent_hash = hash_pair(left_child, right_child)
-            next_level.append(parent_hash)
+        next_level = hash_level(current_level)
 
         tree.append(next_level)
         current_level = next_level
@@ -136,6 +214,308 @@ def build_merkle(leaves):
     return tree
 
 
+def build_lower_levels(sorted_leaves, processes=None):
+    """
+        Hashes the lower levels of the tree in a process pool: the leaves are split into
+        subtrees of 2**depth leaves, each worker returns levels 1..depth of its subtree, and
+        the subtrees' levels are concatenated. Returns those levels (the caller builds the rest)
+        Pads sorted_leaves in place when its length is odd, like build_merkle does
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    # About four subtrees per process, each with at least 2**MIN_SUBTREE_DEPTH leaves
+    depth = max(MIN_SUBTREE_DEPTH, math.ceil(math.log2(len(sorted_leaves) / (4 * processes))))
+    subtree_size = 1 << depth
+    if subtree_size >= len(sorted_leaves):
+        return []
+
+    if len(sorted_leaves) % 2 != 0:
+        sorted_leaves.append(sorted_leaves[-1])
+
+    subtrees = [sorted_leaves[i:i + subtree_size] for i in range(0, len(sorted_leaves), subtree_size)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(build_subtree_levels, subtrees, [depth] * len(subtrees)))
+
+    return [[node for result in results for node in result[level]] for level in range(depth)]
+
+
+def build_subtree_levels(leaves, depth):
+    """
+        Worker for build_lower_levels, returns levels 1..depth above leaves (a list of lists)
+        Odd levels are padded exactly as build_merkle pads them, which is only ever needed in
+        the last subtree since every other subtree has 2**depth leaves
+    """
+    levels = []
+    current_level = leaves
+    for _ in range(depth):
+        if len(current_level) % 2 != 0:
+            current_level.append(current_level[-1])
+        current_level = hash_level(current_level)
+        levels.append(current_level)
+    return levels
+
+
+def hash_level(level):
+    """
+        Hashes a level of the tree (with an even number of nodes) into its parent level
+        Same result as calling hash_pair on every pair, but the level is packed into one buffer
+        and each sorted pair is hashed with the raw keccak-256 primitive, skipping the ABI
+        encoding solidity_keccak does for every call
+    """
+    buffer = b''.join(level)
+    parents = []
+    for i in range(0, len(buffer), 64):
+        left_child = buffer[i:i + 32]
+        right_child = buffer[i + 32:i + 64]
+        if left_child < right_child:
+            parents.append(keccak(buffer[i:i + 64]))
+        else:
+            parents.append(keccak(right_child + left_child))
+    return parents
+
+
+class IncrementalMerkleTree:
+    """
+        Merkle tree that is kept up to date leaf by leaf: append_leaf and update_leaf only rehash
+        the O(log n) nodes on the path from the leaf to the root, the same layout as build_merkle
+        (odd levels are paired with a copy of their last node), so get_proof matches prove_merkle.
+
+        Sorted-leaves policy: build_merkle sorts its leaves, so the root here is equal to
+        build_merkle(leaves)'s root as long as every appended leaf is larger than the previous
+        ones (e.g. new primes); is_sorted tells whether that still holds. Appending out of order is
+        allowed, the tree then keeps insertion order: its proofs are still valid against its own
+        root (the OpenZeppelin verifier sorts each pair) but the root is not build_merkle's.
+        leaf_index() is a dict lookup, kept up to date on every change.
+    """
+
+    def __init__(self, leaves=()):
+        self.levels = [[]]
+        self.index = {}
+        self.is_sorted = True
+        for leaf in sorted(leaves):
+            self.append_leaf(leaf)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def root(self):
+        if not self.levels[0]:
+            return None
+        return self.levels[-1][0]
+
+    def leaf_index(self, leaf):
+        return self.index.get(leaf)
+
+    def append_leaf(self, leaf):
+        """
+            Adds leaf after the current leaves and returns its index
+        """
+        if leaf in self.index:
+            raise ValueError(f"Leaf {leaf.hex()} is already in the tree")
+        leaves = self.levels[0]
+        if leaves and leaf < leaves[-1]:
+            self.is_sorted = False
+        leaves.append(leaf)
+        self.index[leaf] = len(leaves) - 1
+        self._update_path(len(leaves) - 1)
+        return len(leaves) - 1
+
+    def update_leaf(self, index, leaf):
+        """
+            Replaces the leaf at index with leaf
+        """
+        leaves = self.levels[0]
+        if leaf in self.index and self.index[leaf] != index:
+            raise ValueError(f"Leaf {leaf.hex()} is already in the tree")
+        del self.index[leaves[index]]
+        leaves[index] = leaf
+        self.index[leaf] = index
+        if (index > 0 and leaves[index - 1] > leaf) or (index + 1 < len(leaves) and leaf > leaves[index + 1]):
+            self.is_sorted = False
+        self._update_path(index)
+
+    def _update_path(self, index):
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            left_index = index & ~1
+            left_child = nodes[left_index]
+            right_child = nodes[left_index + 1] if left_index + 1 < len(nodes) else left_child
+            parent_hash = keccak(left_child + right_child if left_child < right_child else right_child + left_child)
+
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[level + 1]
+            index //= 2
+            if index == len(parents):
+                parents.append(parent_hash)
+            else:
+                parents[index] = parent_hash
+            level += 1
+
+    def get_proof(self, index):
+        """
+            Returns the proof of inclusion of the leaf at index, same format as prove_merkle
+        """
+        merkle_proof = []
+        for nodes in self.levels[:-1]:
+            sibling_index = index ^ 1
+            # The last node of an odd level is paired with itself
+            merkle_proof.append(nodes[sibling_index] if sibling_index < len(nodes) else nodes[index])
+            index //= 2
+        return merkle_proof
+
+    def to_tree(self):
+        """
+            Returns the tree as build_merkle does (odd levels padded), e.g. for write_merkle_store
+        """
+        tree = []
+        for nodes in self.levels:
+            nodes = list(nodes)
+            if len(nodes) % 2 != 0 and len(nodes) > 1:
+                nodes.append(nodes[-1])
+            tree.append(nodes)
+        return tree
+
+
+class ClaimedLeaves:
+    """
+        Bitmap of the leaves of a tree (MerkleStore) that are already claimed on the contract,
+        built from the contract's claim events and saved next to the tree so later runs only read
+        the events of new blocks. The free leaves are also kept in a list (with each leaf's
+        position in it) so random_free_index() samples a free leaf and mark_claimed() removes
+        one in O(1).
+    """
+
+    def __init__(self, tree, path=None):
+        self.tree = tree
+        self.path = Path(path) if path is not None else Path(__file__).parent.absolute() / f"claimed_leaves_{tree.leaf_count}.bin"
+        self.bitmap = bytearray((tree.leaf_count + 7) // 8)
+        self.synced_block = None
+
+        if self.path.is_file():
+            data = self.path.read_bytes()
+            if len(data) == 8 + len(self.bitmap):
+                synced_block = int.from_bytes(data[:8], 'big', signed=True)
+                # A negative block means no claim event has been read yet
+                self.synced_block = synced_block if synced_block >= 0 else None
+                self.bitmap[:] = data[8:]
+
+        self.free = [i for i in range(tree.leaf_count) if not self.is_claimed(i)]
+        self.free_position = {index: position for position, index in enumerate(self.free)}
+        for index in KNOWN_CLAIMED_LEAVES:
+            if index < tree.leaf_count:
+                self.mark_claimed(index)
+
+    def is_claimed(self, index):
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def mark_claimed(self, index):
+        if self.is_claimed(index):
+            return
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+        # Swap the last free leaf into this leaf's slot
+        position = self.free_position.pop(index)
+        last = self.free.pop()
+        if last != index:
+            self.free[position] = last
+            self.free_position[last] = position
+
+    def random_free_index(self):
+        if not self.free:
+            raise ValueError("Every leaf is already claimed")
+        return random.choice(self.free)
+
+    def refresh(self, w3, address, abi):
+        """
+            Reads the claim events emitted since the last refresh (in CLAIM_LOG_CHUNK_SIZE block
+            ranges) and marks their leaves as claimed. The bitmap is saved after every range, so an
+            error part-way through only loses the range being read
+            Does nothing until CLAIM_EVENT and CLAIM_EVENT_ARG are set
+        """
+        if CLAIM_EVENT is None or CLAIM_EVENT_ARG is None:
+            return
+        contract = w3.eth.contract(address=address, abi=abi)
+        event_name, arg_name = find_claim_event(abi)
+        claim_event = contract.events[event_name]
+
+        if self.synced_block is None:
+            start_block = CLAIM_SCAN_START_BLOCK
+            if start_block is None:
+                start_block = find_deployment_block(w3, address)
+            self.synced_block = start_block - 1
+            self.save()
+
+        latest_block = w3.eth.block_number
+        for from_block in range(self.synced_block + 1, latest_block + 1, CLAIM_LOG_CHUNK_SIZE):
+            to_block = min(latest_block, from_block + CLAIM_LOG_CHUNK_SIZE - 1)
+            for event in claim_event.get_logs(from_block=from_block, to_block=to_block):
+                leaf = event['args'][arg_name]
+                if isinstance(leaf, int):
+                    leaf = leaf.to_bytes(32, 'big')
+                index = self.tree.leaf_index(leaf)
+                if index is not None:
+                    self.mark_claimed(index)
+            self.synced_block = to_block
+            self.save()
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        synced_block = -1 if self.synced_block is None else self.synced_block
+        tmp_path.write_bytes(synced_block.to_bytes(8, 'big', signed=True) + bytes(self.bitmap))
+        os.replace(tmp_path, self.path)
+
+
+def find_claim_event(abi):
+    """
+        Returns the (event name, argument name) holding the claimed leaf in the contract abi,
+        as configured by CLAIM_EVENT and CLAIM_EVENT_ARG
+    """
+    if CLAIM_EVENT is None or CLAIM_EVENT_ARG is None:
+        raise ValueError("Set CLAIM_EVENT and CLAIM_EVENT_ARG to the contract's claim event and its leaf argument")
+    for item in abi:
+        if item.get('type') != 'event' or item['name'] != CLAIM_EVENT:
+            continue
+        for event_input in item['inputs']:
+            if event_input['name'] == CLAIM_EVENT_ARG and event_input['type'] in ['bytes32', 'uint256']:
+                return item['name'], event_input['name']
+    raise ValueError(f"No event {CLAIM_EVENT} with a bytes32/uint256 argument {CLAIM_EVENT_ARG} in the contract ABI")
+
+
+def find_deployment_block(w3, address):
+    """
+        Returns the block the contract at address was deployed in, by binary search on its code
+        This reads historical state, if the node cannot serve it set CLAIM_SCAN_START_BLOCK instead
+    """
+    low = 0
+    high = w3.eth.block_number
+    if not w3.eth.get_code(address, block_identifier=high):
+        raise ValueError(f"No contract at {address}")
+    while low < high:
+        middle = (low + high) // 2
+        if w3.eth.get_code(address, block_identifier=middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def get_merkle_store(num_primes, path=None):
+    """
+        Returns the memory-mapped Merkle tree (merkle_store.MerkleStore) of the first num_primes
+        primes, building and saving it to path on the first call
+    """
+    if path is None:
+        path = Path(__file__).parent.absolute() / f"merkle_primes_{num_primes}.bin"
+
+    if not Path(path).is_file():
+        leaves = convert_leaves(generate_primes(num_primes))
+        write_merkle_store(path, build_merkle(leaves, processes=None), leaf_count=len(leaves))
+
+    return MerkleStore(path)
+
+
 def prove_merkle(merkle_tree, random_indx):
     """
         Takes a random_index to create a proof of inclusion for and a complete Merkle tree
@@ -146,11 +526,7 @@ def prove_merkle(merkle_tree, random_indx):
     merkle_proof = []
     # TODO YOUR CODE HERE
 
-    leaves = merkle_tree[0]
-    original_leaves_count = len(merkle_tree[0])
-    target_leaf_value = leaves[random_indx]
-    current_index = leaves.index(target_leaf_value)
-    current_level_index = current_index
+    current_level_index = random_indx
 
     for level in range(len(merkle_tree) - 1):
         current_level_hashes = merkle_tree[level]
@@ -163,6 +539,122 @@ def prove_merkle(merkle_tree, random_indx):
     return merkle_proof
 
 
+def prove_merkle_multi(merkle_tree, leaf_indices):
+    """
+        Multi-proof of several leaves at once, compatible with OpenZeppelin's
+        MerkleProof.multiProofVerify(proof, proofFlags, root, leaves)
+        merkle_tree is a list of levels as returned by build_merkle (MerkleStore.levels also works)
+        Returns (leaves, proof, proof_flags): leaves must be passed to the verifier in this order,
+        proof only holds the sibling nodes that cannot be computed from the leaves themselves,
+        and proof_flags[i] tells whether the i-th hash uses a second known node (True) or the
+        next proof node (False)
+    """
+    known = sorted(set(leaf_indices))
+    leaves = [merkle_tree[0][i] for i in known]
+    proof = []
+    proof_flags = []
+
+    for level in merkle_tree[:-1]:
+        parents = []
+        position = 0
+        while position < len(known):
+            index = known[position]
+            sibling_index = index ^ 1
+            if sibling_index > index and position + 1 < len(known) and known[position + 1] == sibling_index:
+                # Both children are known, the sibling comes from the leaves/hashes queue
+                proof_flags.append(True)
+                position += 2
+            else:
+                # The last node of an odd level is paired with (a copy of) itself
+                proof.append(level[sibling_index] if sibling_index < len(level) else level[index])
+                proof_flags.append(False)
+                position += 1
+            parents.append(index // 2)
+        known = parents
+
+    return leaves, proof, proof_flags
+
+
+def verify_merkle_multi(root, leaves, proof, proof_flags):
+    """
+        Local equivalent of OpenZeppelin's MerkleProof.multiProofVerify, returns True if
+        the leaves are all part of the tree with the given root
+    """
+    if len(leaves) + len(proof) != len(proof_flags) + 1:
+        return False
+
+    hashes = []
+    leaf_pos = hash_pos = proof_pos = 0
+    for flag in proof_flags:
+        if leaf_pos < len(leaves):
+            a = leaves[leaf_pos]
+            leaf_pos += 1
+        else:
+            a = hashes[hash_pos]
+            hash_pos += 1
+
+        if not flag:
+            if proof_pos >= len(proof):
+                return False
+            b = proof[proof_pos]
+            proof_pos += 1
+        elif leaf_pos < len(leaves):
+            b = leaves[leaf_pos]
+            leaf_pos += 1
+        else:
+            if hash_pos >= len(hashes):
+                return False
+            b = hashes[hash_pos]
+            hash_pos += 1
+
+        hashes.append(keccak(a + b if a < b else b + a))
+
+    if proof_flags:
+        if proof_pos != len(proof):
+            return False
+        computed_root = hashes[-1]
+    elif leaves:
+        computed_root = leaves[0]
+    else:
+        computed_root = proof[0]
+    return computed_root == root
+
+
+def verify_merkle(root, proof, leaf):
+    """
+        Local equivalent of OpenZeppelin's MerkleProof.verify, returns True if proof
+        (as returned by prove_merkle) shows that leaf is part of the tree with the given root
+    """
+    computed_hash = leaf
+    for node in proof:
+        if computed_hash < node:
+            computed_hash = keccak(computed_hash + node)
+        else:
+            computed_hash = keccak(node + computed_hash)
+    return computed_hash == root
+
+
+def get_merkle_root(w3, address, abi, ttl=ROOT_CACHE_TTL):
+    """
+        Returns the merkleRoot of the contract at address, only calling the contract
+        when the cached value is older than ttl seconds
+    """
+    cached = _merkle_root_cache.get(address)
+    if cached is not None and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+
+    onchain_root = w3.eth.contract(address=address, abi=abi).functions.merkleRoot().call()
+    _merkle_root_cache[address] = (onchain_root, time.monotonic())
+    return onchain_root
+
+
+def invalidate_merkle_root(address):
+    """
+        Drops the cached merkleRoot of the contract at address, e.g. after a root change
+    """
+    _merkle_root_cache.pop(address, None)
+
+
 def sign_challenge(challenge):
     """
         Takes a challenge (string)
@@ -183,11 +675,13 @@ def sign_challenge(challenge):
     return addr, eth_sig_obj.signature.hex()
 
 
-def send_signed_msg(proof, random_leaf):
+def send_signed_msg(proof, random_leaf, claimed=None):
     """
         Takes a Merkle proof of a leaf, and that leaf (in bytes32 format)
         builds signs and sends a transaction claiming that leaf (prime)
         on the contract
+        If claimed (ClaimedLeaves) is given, a leaf it knows to be claimed is not submitted,
+        and the leaf is marked claimed in it if the claim reverts
     """
     chain = 'bsc'
 
@@ -203,6 +697,24 @@ def send_signed_msg(proof, random_leaf):
         print(f"Error: Not connected to {chain} node.")
         return tx_hash
 
+    if claimed is not None:
+        index = claimed.tree.leaf_index(random_leaf)
+        if index is not None and claimed.is_claimed(index):
+            print(f"Leaf {random_leaf.hex()} is already claimed, not sending")
+            return tx_hash
+
+    # Check the proof locally first, an invalid proof would only fail later in estimate_gas
+    try:
+        onchain_root = get_merkle_root(w3, address, abi)
+    except Exception as e:
+        print(f"Error reading merkleRoot: {e}")
+        return tx_hash
+    if not verify_merkle(onchain_root, proof, random_leaf):
+        print(f"Proof for leaf {random_leaf.hex()} does not match the on-chain merkleRoot, not sending")
+        # The cached root may be out of date, the next attempt reads it again
+        invalidate_merkle_root(address)
+        return tx_hash
+
     contract = w3.eth.contract(address=address, abi=abi)
 
     # --- TODO YOUR CODE HERE ---
@@ -227,7 +739,15 @@ def send_signed_msg(proof, random_leaf):
         print(f"Transaction sent! Waiting for receipt for tx hash: {tx_hash}")
         tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash_bytes)
         print(f"Transaction receipt: {tx_receipt}")
-
+        if tx_receipt.status != 1:
+            remember_claimed(claimed, random_leaf)
+            invalidate_merkle_root(address)
+
+    except ContractLogicError as e:
+        # The proof matched the on-chain root, so submit() reverting means the leaf is already claimed
+        print(f"Claim reverted: {e}")
+        remember_claimed(claimed, random_leaf)
+        tx_hash = '0x'
     except ConnectionError as e:
         print(f"Connection Error: {e}")
         tx_hash = '0x'
@@ -241,9 +761,25 @@ def send_signed_msg(proof, random_leaf):
         print(f"An unexpected error occurred: {e}")
         tx_hash = '0x'
 
+    if tx_hash == '0x':
+        # Whatever made the claim fail, the root may have changed since it was cached
+        invalidate_merkle_root(address)
+
     return tx_hash
 
 
+def remember_claimed(claimed, leaf):
+    """
+        Marks leaf as claimed in claimed (ClaimedLeaves, or None) and saves it
+    """
+    if claimed is None:
+        return
+    index = claimed.tree.leaf_index(leaf)
+    if index is not None:
+        claimed.mark_claimed(index)
+        claimed.save()
+
+
 # Helper functions that do not need to be modified
 def connect_to(chain):
     """
@@ -0,0 +1,152 @@
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds a cached gas price is used before it is refreshed
+GAS_PRICE_TTL = 15
+
+# One chain context per Web3 connection
+_chain_contexts = weakref.WeakKeyDictionary()
+_chain_contexts_lock = threading.Lock()
+
+# One nonce manager per (chain, account), shared by everything that sends from that account
+_nonce_managers = {}
+_nonce_managers_lock = threading.Lock()
+
+
+class NonceManager:
+    """
+        Hands out nonces locally for one account on one chain so that many signed transactions
+        can be broadcast back to back without waiting for each receipt.
+        The local counter is (re)synced from get_transaction_count(..., 'pending') the first time
+        it is used and whenever a transaction could not be sent or failed, which closes any gap
+        left by a nonce that was handed out but never used.
+    """
+
+    def __init__(self, w3, address):
+        self.w3 = w3
+        self.address = address
+        self.lock = threading.Lock()
+        self.next = None
+
+    def next_nonce(self):
+        with self.lock:
+            if self.next is None:
+                self.next = self.w3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self.next
+            self.next += 1
+            return nonce
+
+    def resync(self):
+        """
+            Drops the local counter, the next call to next_nonce() reloads it from the node
+        """
+        with self.lock:
+            self.next = None
+
+
+def get_nonce_manager(chain, w3, address):
+    """
+        Returns the shared NonceManager for address on chain, creating it on first use
+    """
+    key = (chain, address)
+    with _nonce_managers_lock:
+        if key not in _nonce_managers:
+            _nonce_managers[key] = NonceManager(w3, address)
+        return _nonce_managers[key]
+
+
+class ReceiptTracker:
+    """
+        Waits for the receipts of broadcast transactions in background threads
+        wait() blocks until every tracked transaction has a receipt (or timed out)
+        and returns a list of (tx_hash, receipt) pairs, receipt is None on timeout/error.
+        A tracker is meant for one batch of transactions, wait() also shuts its threads down.
+    """
+
+    def __init__(self, w3, nonce_manager=None, timeout=120, max_workers=8):
+        self.w3 = w3
+        self.nonce_manager = nonce_manager
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = []
+
+    def track(self, tx_hash):
+        self.pending.append((tx_hash, self.executor.submit(self._wait_for_receipt, tx_hash)))
+
+    def _wait_for_receipt(self, tx_hash):
+        try:
+            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=self.timeout)
+        except Exception as e:
+            print(f"No receipt for transaction {tx_hash.hex()}: {e}")
+            receipt = None
+
+        if receipt is None and self.nonce_manager is not None:
+            # A dropped or stuck transaction may leave a nonce gap
+            self.nonce_manager.resync()
+        return receipt
+
+    def wait(self):
+        results = [(tx_hash, future.result()) for tx_hash, future in self.pending]
+        self.pending = []
+        self.executor.shutdown(wait=True)
+        return results
+
+
+class ChainContext:
+    """
+        Per-connection cache for the values needed to build a transaction:
+          chain_id is immutable and fetched once
+          the gas price is kept for gas_price_ttl seconds, and refreshed in a background thread
+          once it is half that old so callers rarely wait on eth_gasPrice
+        Gas limits are deliberately not cached: the estimate is the only check that a call will not
+        revert before it is broadcast, and its cost depends on the argument values
+    """
+
+    def __init__(self, w3, gas_price_ttl=GAS_PRICE_TTL):
+        self.w3 = w3
+        self.gas_price_ttl = gas_price_ttl
+        self.lock = threading.Lock()
+        self._chain_id = None
+        self._gas_price = None
+        self._gas_price_time = 0
+        self._refreshing = False
+
+    @property
+    def chain_id(self):
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
+
+    def gas_price(self):
+        age = time.monotonic() - self._gas_price_time
+        if self._gas_price is None or age >= self.gas_price_ttl:
+            self._refresh_gas_price()
+        elif age >= self.gas_price_ttl / 2:
+            with self.lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(target=self._refresh_gas_price, daemon=True).start()
+        return self._gas_price
+
+    def _refresh_gas_price(self):
+        try:
+            gas_price = self.w3.eth.gas_price
+            with self.lock:
+                self._gas_price = gas_price
+                self._gas_price_time = time.monotonic()
+        finally:
+            with self.lock:
+                self._refreshing = False
+
+
+def get_chain_context(w3):
+    """
+        Returns the shared ChainContext for the Web3 connection w3, creating it on first use
+    """
+    with _chain_contexts_lock:
+        if w3 not in _chain_contexts:
+            _chain_contexts[w3] = ChainContext(w3)
+        return _chain_contexts[w3]